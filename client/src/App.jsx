@@ -13,20 +13,80 @@ export default function App() {
   const [isConnected, setIsConnected] = useState(false);
   const [isConnecting, setIsConnecting] = useState(false);
   const socketRef = useRef(null);
+  const [sessionId, setSessionId] = useState(null);
   const [loadedKeys, setLoadedKeys] = useState(new Set());
   const [isLoadingContext, setIsLoadingContext] = useState(false);
+  const [queueInfo, setQueueInfo] = useState(null);
+  // Id of the reply being streamed and how many of its chunks arrived, so a
+  // dropped connection can resume the reply instead of losing it
+  const turnRef = useRef(null);
+  const sessionIdRef = useRef(null);
+  // Streamed text waiting for the next animation frame, so the message list
+  // updates once per frame rather than once per token
+  const pendingTextRef = useRef("");
+  const frameRef = useRef(null);
+  const nextIdRef = useRef(0);
 
-  const connectToLangGraph = () => {
+  const flushPendingText = () => {
+    cancelAnimationFrame(frameRef.current);
+    frameRef.current = null;
+    const text = pendingTextRef.current;
+    if (!text) return;
+    pendingTextRef.current = "";
+    setMessages((prev) => {
+      const last = prev[prev.length - 1];
+      if (last?.from === "bot") {
+        const updated = prev.slice();
+        updated[updated.length - 1] = { ...last, text: last.text + text };
+        return updated;
+      }
+      return [...prev, { id: nextIdRef.current++, from: "bot", text }];
+    });
+  };
+
+  const appendBotText = (chunk) => {
+    pendingTextRef.current += chunk;
+    if (frameRef.current === null) {
+      frameRef.current = requestAnimationFrame(flushPendingText);
+    }
+  };
+
+  const connectToLangGraph = (resume = false) => {
     setIsConnecting(true);
-    const socket = new WebSocket("ws://127.0.0.1:4580/ws/chat");
+    const params = new URLSearchParams();
+    if (sessionIdRef.current) params.set("session_id", sessionIdRef.current);
+    if (resume && turnRef.current) {
+      params.set("resume_turn", turnRef.current.id);
+      params.set("offset", turnRef.current.offset);
+    }
+    const query = params.toString() ? `?${params}` : "";
+    const socket = new WebSocket(`ws://127.0.0.1:4580/ws/chat${query}`);
     socketRef.current = socket;
 
     socket.onmessage = (event) => {
       const chunk = event.data;
 
-      if (chunk === "[[END]]") {
+      if (chunk.startsWith("[[TURN::")) {
+        turnRef.current = { id: chunk.replace("[[TURN::", "").replace("]]", ""), offset: 0, done: false };
+        return;
+      }
+
+      if (chunk.startsWith("[[RESUME::")) {
+        if (turnRef.current) turnRef.current.retries = 0;
+        setIsTyping(true);
+        return;
+      }
+
+      if (chunk === "[[RESUME_FAILED]]") {
+        flushPendingText();
+        turnRef.current = null;
         setIsTyping(false);
-        setIsLoadingContext(false);
+        return;
+      }
+
+      if (chunk.startsWith("[[SESSION::")) {
+        sessionIdRef.current = chunk.replace("[[SESSION::", "").replace("]]", "");
+        setSessionId(sessionIdRef.current);
         return;
       }
 
@@ -37,16 +97,30 @@ export default function App() {
         return;
       }
 
+      // Everything past the control frames above comes from the turn log, and
+      // the offset must count exactly those frames for a resume to line up
+      if (turnRef.current && !turnRef.current.done) {
+        turnRef.current.offset += 1;
+      }
+
+      if (chunk === "[[END]]") {
+        flushPendingText();
+        if (turnRef.current) turnRef.current.done = true;
+        setIsTyping(false);
+        setIsLoadingContext(false);
+        setQueueInfo(null);
+        return;
+      }
+
+      if (chunk.startsWith("[[QUEUE::")) {
+        const [position, waited] = chunk.replace("[[QUEUE::", "").replace("]]", "").split("::");
+        setQueueInfo({ position: Number(position), waited: Number(waited) });
+        return;
+      }
+
       // Normal bot message logic
-      setMessages((prev) => {
-        const last = prev[prev.length - 1];
-        if (last?.from === "bot") {
-          const updated = [...prev];
-          updated[updated.length - 1] = { ...last, text: last.text + chunk };
-          return updated;
-        }
-        return [...prev, { from: "bot", text: chunk }];
-      });
+      setQueueInfo(null);
+      appendBotText(chunk);
 
       setIsTyping(true);
     };
@@ -61,6 +135,11 @@ export default function App() {
       console.log("❌ WebSocket closed");
       setIsConnected(false);
       setIsConnecting(false);
+      // Dropped mid-reply: reconnect and pick the reply up where it stopped
+      const turn = turnRef.current;
+      if (socketRef.current === socket && turn && !turn.done && (turn.retries = (turn.retries || 0) + 1) <= 5) {
+        setTimeout(() => connectToLangGraph(true), 1000);
+      }
     };
 
     socket.onerror = () => {
@@ -77,7 +156,8 @@ export default function App() {
 
   const sendMessage = () => {
     if (!input.trim() || isTyping || socketRef.current.readyState !== 1) return;
-    setMessages((prev) => [...prev, { from: "user", text: input }]);
+    flushPendingText();
+    setMessages((prev) => [...prev, { id: nextIdRef.current++, from: "user", text: input }]);
     socketRef.current.send(input);
     setInput("");
     setIsTyping(true);
@@ -89,6 +169,7 @@ export default function App() {
         loadedKeys={loadedKeys}
         setLoadedKeys={setLoadedKeys}
         socketRef={socketRef}
+        sessionId={sessionId}
         isLoadingContext={isLoadingContext}
         setIsLoadingContext={setIsLoadingContext}
       />
@@ -98,7 +179,7 @@ export default function App() {
           <div className="connect-screen">
             <button
               className={`connect-button ${isConnecting ? 'connecting' : ''}`}
-              onClick={connectToLangGraph}
+              onClick={() => connectToLangGraph()}
               disabled={isConnecting}
             >
               {isConnecting ? 'Connecting...' : 'Connect to DeepSeek-V3'}
@@ -110,6 +191,7 @@ export default function App() {
               messages={messages}
               isTyping={isTyping}
               isLoadingContext={isLoadingContext}
+              queueInfo={queueInfo}
             />
             <InputArea
               input={input}
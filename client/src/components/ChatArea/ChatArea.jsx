@@ -1,10 +1,128 @@
 // components/ChatArea.jsx
-import React from "react";
+import React, { memo, useCallback, useEffect, useLayoutEffect, useRef, useState } from "react";
 import ReactMarkdown from "react-markdown";
 import CodeBlock from './CodeBlock';
 import './ChatArea.css';
 
-export default function ChatArea({ messages, isTyping, isLoadingContext }) {
+// Height assumed for a message until it has been rendered and measured
+const ESTIMATED_HEIGHT = 120;
+// Pixels above and below the viewport that stay mounted, so scrolling doesn't flash
+const OVERSCAN = 800;
+
+const markdownComponents = {
+    code({ inline, className, children }) {
+        const match = /language-(\w+)/.exec(className || "");
+        const codeString = String(children).trim();
+        return !inline && match ? (
+            <CodeBlock language={match[1]} value={codeString} />
+        ) : (
+            <code className={className}>{codeString}</code>
+        );
+    }
+};
+
+// Memoized on (from, text): finished messages, and their highlighted code
+// blocks, don't re-render while the next reply streams in
+const Message = memo(function Message({ from, text }) {
+    return (
+        <div className={`message-row ${from}`}>
+            <div className={`message-bubble ${from}`}>
+                {from === "bot" ? (
+                    <ReactMarkdown components={markdownComponents}>
+                    {text}
+                    </ReactMarkdown>
+                ) : text}
+            </div>
+        </div>
+    );
+});
+
+function scrollParent(element) {
+    for (let node = element?.parentElement; node; node = node.parentElement) {
+        const { overflowY } = getComputedStyle(node);
+        if (overflowY === "auto" || overflowY === "scroll") return node;
+    }
+    return document.scrollingElement;
+}
+
+// Reports its height (including the 1rem gap below it) whenever it changes
+function MeasuredRow({ id, onHeight, children }) {
+    const ref = useRef(null);
+    useLayoutEffect(() => {
+        const element = ref.current;
+        const observer = new ResizeObserver(() => onHeight(id, element.offsetHeight));
+        observer.observe(element);
+        return () => observer.disconnect();
+    }, [id, onHeight]);
+    return <div ref={ref} style={{ paddingBottom: "1rem" }}>{children}</div>;
+}
+
+export default function ChatArea({ messages, isTyping, isLoadingContext, queueInfo }) {
+    const listRef = useRef(null);
+    const heights = useRef(new Map());
+    const frame = useRef(null);
+    const [viewport, setViewport] = useState({ top: 0, height: window.innerHeight });
+
+    // Scroll, resize and height changes are folded into one layout pass per frame
+    const scheduleLayout = useCallback(() => {
+        if (frame.current) return;
+        frame.current = requestAnimationFrame(() => {
+            frame.current = null;
+            const list = listRef.current;
+            if (!list) return;
+            const scroller = scrollParent(list);
+            setViewport({
+                top: scroller.getBoundingClientRect().top - list.getBoundingClientRect().top,
+                height: scroller.clientHeight,
+            });
+        });
+    }, []);
+
+    const onHeight = useCallback((id, height) => {
+        if (heights.current.get(id) !== height) {
+            heights.current.set(id, height);
+            scheduleLayout();
+        }
+    }, [scheduleLayout]);
+
+    useEffect(() => {
+        const scroller = scrollParent(listRef.current);
+        scroller.addEventListener("scroll", scheduleLayout, { passive: true });
+        window.addEventListener("resize", scheduleLayout);
+        scheduleLayout();
+        return () => {
+            scroller.removeEventListener("scroll", scheduleLayout);
+            window.removeEventListener("resize", scheduleLayout);
+            cancelAnimationFrame(frame.current);
+            frame.current = null;
+        };
+    }, [scheduleLayout]);
+
+    // Only messages near the viewport are mounted; spacers stand in for the rest
+    const windowTop = viewport.top - OVERSCAN;
+    const windowBottom = viewport.top + viewport.height + OVERSCAN;
+    let start = messages.length;
+    let end = messages.length;
+    let before = 0;
+    let offset = 0;
+    messages.forEach((msg, i) => {
+        const height = heights.current.get(msg.id ?? i) ?? ESTIMATED_HEIGHT;
+        if (start === messages.length && offset + height > windowTop) {
+            start = i;
+            before = offset;
+        }
+        if (end === messages.length && offset >= windowBottom) {
+            end = i;
+        }
+        offset += height;
+    });
+    end = Math.max(start, end);
+    let visibleHeight = 0;
+    for (let i = start; i < end; i++) {
+        visibleHeight += heights.current.get(messages[i].id ?? i) ?? ESTIMATED_HEIGHT;
+    }
+    const after = offset - before - visibleHeight;
+
     return (
         <div className="chat-area">
             <div className="messages-wrapper">
@@ -18,29 +136,15 @@ export default function ChatArea({ messages, isTyping, isLoadingContext }) {
                             </div>
                         </div>
                     )}
-                    {messages.map((msg, i) => (
-                        <div key={i} className={`message-row ${msg.from}`}>
-                            <div className={`message-bubble ${msg.from}`}>
-                                {msg.from === "bot" ? (
-                                    <ReactMarkdown
-                                        components={{
-                                            code({ inline, className, children }) {
-                                                const match = /language-(\w+)/.exec(className || "");
-                                                const codeString = String(children).trim();
-                                                return !inline && match ? (
-                                                    <CodeBlock language={match[1]} value={codeString} />
-                                                ) : (
-                                                    <code className={className}>{codeString}</code>
-                                                );
-                                            }
-                                        }}
-                                    >
-                                    {msg.text}
-                                    </ReactMarkdown>
-                                ) : msg.text}
-                            </div>
-                        </div>
-                    ))}
+                    <div ref={listRef}>
+                        <div style={{ height: before }} />
+                        {messages.slice(start, end).map((msg, i) => (
+                            <MeasuredRow key={msg.id ?? start + i} id={msg.id ?? start + i} onHeight={onHeight}>
+                                <Message from={msg.from} text={msg.text} />
+                            </MeasuredRow>
+                        ))}
+                        <div style={{ height: after }} />
+                    </div>
                     {isLoadingContext && (
                         <div className="message-row bot">
                             <div className="message-bubble bot">
@@ -49,7 +153,13 @@ export default function ChatArea({ messages, isTyping, isLoadingContext }) {
                         </div>
                     )
                     }
-                    {isTyping && <div className="typing">thinking...</div>}
+                    {isTyping && (
+                        <div className="typing">
+                            {queueInfo
+                                ? `waiting in queue (#${queueInfo.position}, ${Math.round(queueInfo.waited)}s)...`
+                                : "thinking..."}
+                        </div>
+                    )}
                 </div>
             </div>
         </div>
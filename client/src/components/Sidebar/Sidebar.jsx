@@ -2,17 +2,18 @@
 import React, { useState } from "react";
 import './Sidebar.css';
 
-export default function Sidebar({ loadedKeys, setLoadedKeys, socketRef, isLoadingContext, setIsLoadingContext }) {
+export default function Sidebar({ loadedKeys, setLoadedKeys, socketRef, sessionId, isLoadingContext, setIsLoadingContext }) {
     const [uploadedFiles, setUploadedFiles] = useState([]);
     const [fileMap, setFileMap] = useState({});
     const [loadingContext, setLoadingContext] = useState(false);
 
     const handleFileUpload = async (event) => {
         const files = Array.from(event.target.files);
-        if (files.length === 0) return;
+        if (files.length === 0 || !sessionId) return;
 
         const formData = new FormData();
         files.forEach(file => formData.append("files", file));
+        formData.append("session_id", sessionId);
 
         try {
             const response = await fetch("http://localhost:4580/upload", {
@@ -53,6 +54,7 @@ export default function Sidebar({ loadedKeys, setLoadedKeys, socketRef, isLoadin
     const handleDeleteFile = async (key, index) => {
         const formData = new FormData();
         formData.append("file_key", key);
+        formData.append("session_id", sessionId);
 
         const response = await fetch("http://localhost:4580/delete-file", {
             method: "POST",
@@ -0,0 +1,105 @@
+# chat/answer_cache.py
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+
+def normalize_question(question: str) -> str:
+    """Lowercase, collapse whitespace and drop trailing punctuation so trivially
+    different phrasings of the same question share a key."""
+    text = re.sub(r"\s+", " ", question.strip().lower())
+    return text.rstrip(" ?!.")
+
+
+def corpus_hash(context: str, model_config: dict) -> str:
+    h = hashlib.sha256()
+    h.update(context.encode("utf-8"))
+    h.update(json.dumps(model_config, sort_keys=True).encode("utf-8"))
+    return h.hexdigest()
+
+
+class AnswerCache:
+    """
+    SQLite-backed cache of structured code-gen answers, keyed by normalized
+    question plus corpus hash (docs + model config). Entries expire after `ttl`
+    seconds, the table is trimmed to `max_entries` by least recent use, and
+    entries from an older corpus are dropped as soon as a new one is seen.
+    """
+
+    def __init__(self, path: str, ttl: float = 7 * 24 * 3600, max_entries: int = 1000):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._current_corpus: Optional[str] = None
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS answers (
+                question TEXT NOT NULL,
+                corpus TEXT NOT NULL,
+                solution TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (question, corpus)
+            )"""
+        )
+        self._conn.commit()
+
+    def _sync_corpus(self, corpus: str):
+        # Caller holds the lock and an open `with self._conn:` transaction
+        if corpus != self._current_corpus:
+            self._conn.execute("DELETE FROM answers WHERE corpus != ?", (corpus,))
+            self._current_corpus = corpus
+
+    def get(self, question: str, corpus: str) -> Optional[dict]:
+        now = time.time()
+        # `with self._conn` commits (or rolls back) on every exit path, so no
+        # write transaction is left holding the database lock after a miss
+        with self._lock, self._conn:
+            self._sync_corpus(corpus)
+            row = self._conn.execute(
+                "SELECT solution, created_at FROM answers WHERE question = ? AND corpus = ?",
+                (normalize_question(question), corpus),
+            ).fetchone()
+            if row is None:
+                return None
+            solution, created_at = row
+            if now - created_at > self.ttl:
+                self._conn.execute(
+                    "DELETE FROM answers WHERE question = ? AND corpus = ?",
+                    (normalize_question(question), corpus),
+                )
+                return None
+            self._conn.execute(
+                "UPDATE answers SET last_used = ? WHERE question = ? AND corpus = ?",
+                (now, normalize_question(question), corpus),
+            )
+            return json.loads(solution)
+
+    def put(self, question: str, corpus: str, solution: dict):
+        now = time.time()
+        with self._lock, self._conn:
+            self._sync_corpus(corpus)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?)",
+                (normalize_question(question), corpus, json.dumps(solution), now, now),
+            )
+            self._conn.execute("DELETE FROM answers WHERE created_at < ?", (now - self.ttl,))
+            self._conn.execute(
+                """DELETE FROM answers WHERE rowid NOT IN (
+                    SELECT rowid FROM answers ORDER BY last_used DESC LIMIT ?
+                )""",
+                (self.max_entries,),
+            )
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM answers")
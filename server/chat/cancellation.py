@@ -0,0 +1,63 @@
+# chat/cancellation.py
+
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from itertools import count
+from typing import Callable
+
+
+class CancellationRegistry:
+    """
+    In-flight work that outlives an asyncio task cancel (tool worker processes,
+    sandbox kernels) registers a cancel callback here for its session. When a
+    turn is stopped or preempted, the server cancels the session and every
+    registered callback runs. Counters record how much work was cut short.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids = count()
+        self._callbacks: dict[str, dict[int, tuple[str, Callable[[], None]]]] = {}
+        self.stats: Counter = Counter()
+
+    @contextmanager
+    def track(self, session_id: str, kind: str, cancel: Callable[[], None]):
+        token = next(self._ids)
+        with self._lock:
+            self._callbacks.setdefault(session_id, {})[token] = (kind, cancel)
+        try:
+            yield
+        finally:
+            with self._lock:
+                callbacks = self._callbacks.get(session_id, {})
+                callbacks.pop(token, None)
+                if not callbacks:
+                    self._callbacks.pop(session_id, None)
+
+    def record(self, kind: str, n: int = 1):
+        with self._lock:
+            self.stats[kind] += n
+
+    def cancel(self, session_id: str) -> Counter:
+        """Run every cancel callback registered for the session; returns what was freed."""
+        with self._lock:
+            callbacks = list(self._callbacks.pop(session_id, {}).values())
+            self.stats["cancelled_turns"] += 1
+        freed = Counter()
+        for kind, cancel in callbacks:
+            try:
+                cancel()
+                freed[kind] += 1
+            except Exception as e:
+                print(f"Cancel callback for {kind} failed: {e}")
+        with self._lock:
+            self.stats.update(freed)
+        return freed
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self.stats)
+
+
+cancellations = CancellationRegistry()
@@ -1,19 +1,48 @@
 # chat/code_ass_graph
 
+import asyncio
+import os
+import time
 from dotenv import load_dotenv
-from bs4 import BeautifulSoup as Soup
 from pydantic import BaseModel, Field
-from langchain_community.document_loaders.recursive_url_loader import RecursiveUrlLoader
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_deepseek import ChatDeepSeek
 from langchain_core.messages import HumanMessage
 from langchain_core.runnables import Runnable
 from langgraph.graph import StateGraph, START, END
+from langgraph.utils.runnable import RunnableCallable
 from typing import List
 from typing_extensions import TypedDict
+from chat.answer_cache import AnswerCache, corpus_hash
+from chat.doc_crawler import DocCrawler, PageStore
+from chat.repair import repair_structured_output
+from chat.prompt_cache import cache_stats
+from chat.scheduler import StreamTracker, scheduler, estimate_tokens
 
 load_dotenv()
 
+DOCS_URL = "https://python.langchain.com/docs/concepts/lcel/"
+DOCS_TTL = 3600  # Re-crawl the docs at most once an hour
+MODEL_CONFIG = {"model": "deepseek-chat", "temperature": 0}
+
+# Speculative mode: number of concurrent generations per attempt (1 = off)
+SPECULATIVE_K = int(os.environ.get("CODEGEN_SPECULATIVE_K", 1))
+SPECULATIVE_TEMPERATURE = 0.7
+
+doc_crawler = DocCrawler(
+    DOCS_URL,
+    PageStore(os.environ.get("DOCS_PAGES_PATH", "cache/docs_pages.sqlite")),
+    max_depth=20,
+    per_host=int(os.environ.get("DOCS_CRAWL_CONCURRENCY", 8)),
+    manifest_path=os.environ.get("DOCS_MANIFEST_PATH", "cache/docs_manifest.json"),
+)
+
+answer_cache = AnswerCache(
+    os.environ.get("CODEGEN_CACHE_PATH", "cache/codegen_answers.sqlite"),
+    ttl=float(os.environ.get("CODEGEN_CACHE_TTL", 7 * 24 * 3600)),
+    max_entries=int(os.environ.get("CODEGEN_CACHE_SIZE", 1000)),
+)
+
 # -----------------------
 # 1) Define the Data Model
 # -----------------------
@@ -24,7 +53,35 @@ class CodeSolution(BaseModel):
     code: str = Field(description="Code block not including import statements")
 
 # -----------------------
-# 2) Graph Node Functions
+# 2) Prompt
+# -----------------------
+# Compiled once. The system message (instructions + docs) is byte-identical for
+# every call, and the conversation is only ever appended to, so retries share
+# the provider-side cached prefix instead of re-paying for the docs.
+CODE_GEN_PROMPT = ChatPromptTemplate.from_messages(
+    [
+        (
+            "system",
+            """<instructions>
+            You are a coding assistant with expertise in LCEL (LangChain Expression Language).
+            Here is the LCEL documentation:
+            -------
+            {context}
+            -------
+            Answer the user question based on the above docs. Provide code that can be executed,
+            including all imports and variables. Structure your output via the code tool with:
+            1) prefix
+            2) imports
+            3) code
+            </instructions>
+            """,
+        ),
+        ("placeholder", "{messages}"),
+    ]
+)
+
+# -----------------------
+# 3) Graph Node Functions
 # -----------------------
 class GraphState(TypedDict, total=False):
     """
@@ -46,23 +103,44 @@ class GraphState(TypedDict, total=False):
     context: str
     raw_llm_output: dict
     final_solution: CodeSolution
+    session_id: str
+    priority: str
     
-def read_docs(state: GraphState) -> GraphState:
+_docs_cache: dict = {}
+
+def load_docs() -> str:
     """
-    Loads the LCEL documentation from a URL and stores it into the graph state.
+    Crawls the LCEL documentation and returns it as a single text block.
+    The result is kept in memory for DOCS_TTL seconds; a re-crawl only
+    re-downloads pages whose ETag / Last-Modified changed.
     """
-    url = "https://python.langchain.com/docs/concepts/lcel/"
-    crawler = RecursiveUrlLoader(url=url, max_depth=20, extractor=lambda x: Soup(x, "html.parser").text)
-    docs = crawler.load()
-    print(f"\nRead: {len(docs)} docs")
+    if _docs_cache and time.time() - _docs_cache["loaded_at"] < DOCS_TTL:
+        return _docs_cache["context"]
+
+    manifest = doc_crawler.crawl_sync()
+    if not manifest.dirty and "context" in _docs_cache:
+        # Nothing changed: keep the same text so corpus-keyed caches stay valid
+        _docs_cache["loaded_at"] = time.time()
+        return _docs_cache["context"]
+    pages = doc_crawler.store.pages()
+    print(f"\nRead: {len(pages)} docs ({len(manifest.added)} added, {len(manifest.changed)} changed, "
+          f"{len(manifest.removed)} removed)")
 
     # Sort and reverse so we produce a single large text block
-    d_sorted = sorted(docs, key=lambda x: x.metadata["source"])
-    d_reversed = list(reversed(d_sorted))
-    concatenated_content = "\n\n\n --- \n\n\n".join([doc.page_content for doc in d_reversed])
+    d_reversed = sorted(pages.values(), key=lambda page: page.url, reverse=True)
+    concatenated_content = "\n\n\n --- \n\n\n".join([page.text for page in d_reversed])
+
+    _docs_cache.update(context=concatenated_content, loaded_at=time.time())
+    return concatenated_content
 
+def read_docs(state: GraphState) -> GraphState:
+    """
+    Loads the LCEL documentation and stores it into the graph state,
+    unless the caller already provided it.
+    """
     # Store in state
-    state["context"] = concatenated_content
+    if not state.get("context"):
+        state["context"] = load_docs()
     # Initialize iteration counter, error, and messages
     state["iterations"] = 0
     state["error"] = ""
@@ -70,70 +148,139 @@ def read_docs(state: GraphState) -> GraphState:
     state.setdefault("messages", [])
     return state
 
-def generate(state: GraphState) -> GraphState:
+def _with_repair(response: dict) -> dict:
+    """If the structured output did not parse, try a local repair before the
+    graph falls back to another LLM round trip."""
+    cache_stats.record("generate", response["raw"])
+    if response.get("parsed") is None:
+        repaired = repair_structured_output(response["raw"], CodeSolution)
+        if repaired is not None:
+            print("---REPAIRED OUTPUT LOCALLY---")
+            response = {**response, "parsed": repaired, "parsing_error": None}
+    return response
+
+def _structured_llm(temperature: float):
+    llm = ChatDeepSeek(**{**MODEL_CONFIG, "temperature": temperature}, max_retries=0)
+    return llm.with_structured_output(CodeSolution, include_raw=True)
+
+def _generate_candidate(prompt: ChatPromptTemplate, inputs: dict, temperature: float, session_id: str,
+                        priority: str) -> dict:
+    """One structured-output LLM call, locally repaired if it does not parse."""
+    tracker = StreamTracker()
+    chain = (prompt | _structured_llm(temperature)).with_config(callbacks=[tracker])
+    # Runs inside a tool call of the user's turn, so it queues at that turn's priority
+    response = scheduler.submit(
+        lambda: chain.invoke(inputs),
+        session_id=session_id, priority=priority,
+        tokens=estimate_tokens([inputs["context"], *inputs["messages"]], completion=1024),
+        output_started=tracker.started,
+    )
+    return _with_repair(response)
+
+async def _agenerate_candidate(prompt: ChatPromptTemplate, inputs: dict, temperature: float, session_id: str,
+                               priority: str) -> dict:
+    """Async _generate_candidate: cancelling it closes the provider HTTP stream."""
+    tracker = StreamTracker()
+    chain = (prompt | _structured_llm(temperature)).with_config(callbacks=[tracker])
+    response = await scheduler.asubmit(
+        lambda: chain.ainvoke(inputs),
+        session_id=session_id, priority=priority,
+        tokens=estimate_tokens([inputs["context"], *inputs["messages"]], completion=1024),
+        output_started=tracker.started,
+    )
+    return _with_repair(response)
+
+async def _agenerate_speculative(prompt: ChatPromptTemplate, inputs: dict, k: int, session_id: str,
+                                 priority: str) -> dict:
+    temperatures = [MODEL_CONFIG["temperature"]] + [SPECULATIVE_TEMPERATURE] * (k - 1)
+    tasks = [asyncio.create_task(_agenerate_candidate(prompt, inputs, t, session_id, priority)) for t in temperatures]
+    fallback = None
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            try:
+                response = await next_done
+            except Exception as e:
+                print(f"Speculative candidate failed: {e}")
+                continue
+            if response.get("parsed") is not None:
+                return response
+            fallback = fallback or response
+    finally:
+        # Cancel the slower candidates: this aborts their requests, so they stop
+        # generating (and billing) and give their scheduler slots back
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    if fallback is None:
+        raise RuntimeError("All speculative candidates failed")
+    return fallback
+
+def _generate_speculative(prompt: ChatPromptTemplate, inputs: dict, k: int, session_id: str,
+                          priority: str) -> dict:
     """
-    Build the prompt and call the LLM with structured output. If we had a prior parsing error,
-    we nudge the assistant to re-invoke the code tool.
+    Send k generations concurrently and return the first that parses (after local
+    repair). Extra candidates use a higher temperature, since k identical
+    temperature-0 requests would just fail the same way.
     """
-    print("---GENERATING CODE SOLUTION---")
+    # Graph nodes run in a worker thread with no event loop of their own
+    return asyncio.run(_agenerate_speculative(prompt, inputs, k, session_id, priority))
 
-    # Pull items from state
-    context = state["context"]
+def _generate_inputs(state: GraphState) -> dict:
+    """Prompt inputs for the next generation; after a parsing error the LLM is
+    nudged to re-invoke the code tool."""
     messages = state["messages"]
-    error_flag = state["error"]
-
-    # If we got here after a parsing error, nudge the LLM to fix its response
-    if error_flag == "yes":
+    if state["error"] == "yes":
         messages += [
             (
                 "assistant",
                 "Retry. You must invoke the code tool with prefix, imports, and code fields. Fix your parsing errors."
             )
         ]
+    return {"context": state["context"], "messages": messages}
 
-    # Create the prompt
-    code_gen_prompt = ChatPromptTemplate.from_messages(
-        [
-            (
-                "system",
-                """<instructions>
-                You are a coding assistant with expertise in LCEL (LangChain Expression Language).
-                Here is the LCEL documentation:
-                -------
-                {context}
-                -------
-                Answer the user question based on the above docs. Provide code that can be executed,
-                including all imports and variables. Structure your output via the code tool with:
-                1) prefix
-                2) imports
-                3) code
-                </instructions>
-                """,
-            ),
-            ("placeholder", "{messages}"),
-        ]
-    )
-
-    # Create your LLM with structured output
-    llm = ChatDeepSeek(temperature=0, model="deepseek-chat")
-    structured_llm = llm.with_structured_output(CodeSolution, include_raw=True)
-    prompt_to_llm = code_gen_prompt | structured_llm
-
-    # Invoke LLM
-    response = prompt_to_llm.invoke({"context": context, "messages": messages})
-
+def _record_generation(state: GraphState, response: dict) -> GraphState:
     # Store the raw LLM output to state (for debugging or further checks)
     state["raw_llm_output"] = response
 
     # Add the LLM's text to messages so the conversation is updated
     # NOTE: If you want to show partial “assistant” content, you can do so, but here we keep minimal
     assistant_text = response["raw"].content  # The raw text from the LLM
-    messages += [("assistant", assistant_text)]
-
-    # Update state
-    state["messages"] = messages
+    state["messages"] += [("assistant", assistant_text)]
     return state
 
+def generate(state: GraphState) -> GraphState:
+    """
+    Build the prompt and call the LLM with structured output. If we had a prior parsing error,
+    we nudge the assistant to re-invoke the code tool.
+    """
+    print("---GENERATING CODE SOLUTION---")
+    inputs = _generate_inputs(state)
+    session_id = state.get("session_id", "default")
+    priority = state.get("priority", "interactive")
+
+    # Invoke LLM, with K concurrent candidates in speculative mode
+    if SPECULATIVE_K > 1:
+        response = _generate_speculative(CODE_GEN_PROMPT, inputs, SPECULATIVE_K, session_id, priority)
+    else:
+        response = _generate_candidate(CODE_GEN_PROMPT, inputs, MODEL_CONFIG["temperature"], session_id, priority)
+    return _record_generation(state, response)
+
+async def agenerate(state: GraphState) -> GraphState:
+    """Async generate, used by app.ainvoke: cancelling the run cancels the
+    in-flight (or queued) LLM calls instead of letting them finish."""
+    print("---GENERATING CODE SOLUTION---")
+    inputs = _generate_inputs(state)
+    session_id = state.get("session_id", "default")
+    priority = state.get("priority", "interactive")
+
+    if SPECULATIVE_K > 1:
+        response = await _agenerate_speculative(CODE_GEN_PROMPT, inputs, SPECULATIVE_K, session_id, priority)
+    else:
+        response = await _agenerate_candidate(CODE_GEN_PROMPT, inputs, MODEL_CONFIG["temperature"],
+                                              session_id, priority)
+    return _record_generation(state, response)
+
 def check_parsing(state: GraphState) -> GraphState:
     """
     Check if the LLM properly invoked the code tool (i.e., we have 'parsed' result).
@@ -178,13 +325,13 @@ def decide_to_finish(state: GraphState) -> str:
         return "generate"
 
 # -----------------------
-# 3) Build the Graph
+# 4) Build the Graph
 # -----------------------
 workflow = StateGraph(GraphState)
 
 # Nodes
 workflow.add_node("read_docs", read_docs)
-workflow.add_node("generate", generate)
+workflow.add_node("generate", RunnableCallable(generate, agenerate))
 workflow.add_node("check_parsing", check_parsing)
 
 # Edges
@@ -205,15 +352,26 @@ app = workflow.compile()
 
 
 # -----------------------
-# 4) Provide a Helper
+# 5) Provide a Helper
 # -----------------------
-def code_ass_help(question: str = "How do I build an RAG chain in LCEL?"):
+def code_ass_help(question: str = "How do I build an RAG chain in LCEL?", session_id: str = "default",
+                  priority: str = "interactive"):
     """
     Graph-based invocation that returns a code solution from the LLM.
+    Answers are cached per normalized question and docs/model version.
     """
+    context = load_docs()
+    corpus = corpus_hash(context, MODEL_CONFIG)
+    if cached := answer_cache.get(question, corpus):
+        print("---CODE SOLUTION FROM CACHE---")
+        return CodeSolution(**cached)
+
     # We start with minimal user "messages", just the question
     initial_state = {
         "messages": [("user", question)],
+        "context": context,
+        "session_id": session_id,
+        "priority": priority,
     }
 
     # Invoke the graph
@@ -221,6 +379,7 @@ def code_ass_help(question: str = "How do I build an RAG chain in LCEL?"):
 
     if final_state.get("final_solution"):
         # Return the parsed code solution (prefix, imports, code)
+        answer_cache.put(question, corpus, final_state["final_solution"].model_dump())
         return final_state["final_solution"]
     else:
         # If no final solution, either we had too many errors or something else happened
@@ -228,11 +387,35 @@ def code_ass_help(question: str = "How do I build an RAG chain in LCEL?"):
 
 
 # -----------------------
-# 5) Example usage
+# 6) Example usage
 # -----------------------
 if __name__ == "__main__":
     solution = code_ass_help("How do I load text into LCEL and run a simple chain?")
     print("Solution:")
     print("PREFIX:\n", solution.prefix)
     print("\nIMPORTS:\n", solution.imports)
-    print("\nCODE:\n", solution.code)
\ No newline at end of file
+    print("\nCODE:\n", solution.code)
+async def acode_ass_help(question: str, session_id: str = "default", priority: str = "interactive"):
+    """
+    Async code_ass_help. The LLM calls are awaited on the caller's task, so
+    cancelling the turn cancels them (and their retries) rather than leaving
+    them running in an executor thread.
+    """
+    context = await asyncio.to_thread(load_docs)
+    corpus = corpus_hash(context, MODEL_CONFIG)
+    if cached := await asyncio.to_thread(answer_cache.get, question, corpus):
+        print("---CODE SOLUTION FROM CACHE---")
+        return CodeSolution(**cached)
+
+    initial_state = {
+        "messages": [("user", question)],
+        "context": context,
+        "session_id": session_id,
+        "priority": priority,
+    }
+    final_state = await app.ainvoke(initial_state)
+
+    if final_state.get("final_solution"):
+        await asyncio.to_thread(answer_cache.put, question, corpus, final_state["final_solution"].model_dump())
+        return final_state["final_solution"]
+    return None
@@ -0,0 +1,255 @@
+# chat/doc_crawler.py
+
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import Optional
+from urllib.parse import urldefrag, urljoin, urlsplit
+
+import httpx
+import lxml.html
+from lxml.etree import ParserError
+
+
+def extract(html: bytes, base_url: str) -> tuple[str, list[str]]:
+    """
+    Visible text and absolute link targets of an HTML page, via lxml (C parser).
+    Takes the raw bytes: lxml rejects a str that carries an XML encoding
+    declaration, and detects the charset itself from bytes.
+    """
+    try:
+        tree = lxml.html.fromstring(html)
+    except ParserError:  # Empty or non-HTML body
+        return "", []
+    links = [urldefrag(urljoin(base_url, href.strip()))[0] for href in tree.xpath("//a/@href")]
+    for element in tree.xpath("//script | //style | //noscript"):
+        element.drop_tree()
+    return tree.text_content(), links
+
+
+class PageRecord:
+    def __init__(self, url: str, etag: str = "", last_modified: str = "", content_hash: str = "",
+                 text: str = "", links: Optional[list[str]] = None, fetched_at: float = 0.0):
+        self.url = url
+        self.etag = etag
+        self.last_modified = last_modified
+        self.content_hash = content_hash
+        self.text = text
+        self.links = links or []
+        self.fetched_at = fetched_at
+
+
+class PageStore:
+    """
+    SQLite copy of every crawled page: validators (ETag / Last-Modified) for
+    conditional requests, extracted text, and outgoing links so an unchanged
+    (304) page can still be traversed.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS pages (
+                url TEXT PRIMARY KEY,
+                etag TEXT NOT NULL,
+                last_modified TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                text TEXT NOT NULL,
+                links TEXT NOT NULL,
+                fetched_at REAL NOT NULL
+            )"""
+        )
+        self._conn.commit()
+
+    def pages(self) -> dict[str, PageRecord]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT url, etag, last_modified, content_hash, text, links, fetched_at FROM pages"
+            ).fetchall()
+        return {
+            url: PageRecord(url, etag, modified, digest, text, json.loads(links), fetched_at)
+            for url, etag, modified, digest, text, links, fetched_at in rows
+        }
+
+    def save(self, records: list[PageRecord], removed: list[str]):
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(r.url, r.etag, r.last_modified, r.content_hash, r.text, json.dumps(r.links), r.fetched_at)
+                 for r in records],
+            )
+            self._conn.executemany("DELETE FROM pages WHERE url = ?", [(url,) for url in removed])
+            self._conn.commit()
+
+
+class CrawlManifest:
+    """What one crawl found, so downstream indexes only touch pages that moved."""
+
+    def __init__(self, start_url: str):
+        self.start_url = start_url
+        self.started_at = time.time()
+        self.finished_at = 0.0
+        self.added: list[str] = []
+        self.changed: list[str] = []
+        self.unchanged: list[str] = []
+        self.removed: list[str] = []
+        self.failed: list[str] = []
+
+    @property
+    def dirty(self) -> bool:
+        return bool(self.added or self.changed or self.removed)
+
+    def to_dict(self) -> dict:
+        return {
+            "start_url": self.start_url,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            **{key: sorted(getattr(self, key))
+               for key in ("added", "changed", "unchanged", "removed", "failed")},
+        }
+
+
+class DocCrawler:
+    """
+    Async crawler for a docs site, replacing RecursiveUrlLoader's one-page-at-a-
+    time walk. Pages under `start_url` are fetched concurrently (at most
+    `per_host` requests in flight per host) with If-None-Match /
+    If-Modified-Since, so an unchanged page costs a 304 and no parsing. Each
+    crawl writes a manifest of added / changed / removed pages.
+    """
+
+    def __init__(self, start_url: str, store: PageStore, max_depth: int = 20, per_host: int = 8,
+                 timeout: float = 15.0, manifest_path: Optional[str] = None):
+        self.start_url = start_url
+        self.store = store
+        self.max_depth = max_depth
+        self.per_host = per_host
+        self.timeout = timeout
+        self.manifest_path = manifest_path
+        self._host_slots: dict[str, asyncio.Semaphore] = {}
+
+    def _in_scope(self, url: str) -> bool:
+        return url.startswith(self.start_url) and urlsplit(url).scheme in ("http", "https")
+
+    @asynccontextmanager
+    async def _host_limit(self, url: str):
+        async with self._host_slots[urlsplit(url).netloc]:
+            yield
+
+    async def _fetch(self, client: httpx.AsyncClient, url: str, previous: Optional[PageRecord],
+                     manifest: CrawlManifest) -> Optional[PageRecord]:
+        headers = {}
+        if previous is not None:
+            if previous.etag:
+                headers["If-None-Match"] = previous.etag
+            if previous.last_modified:
+                headers["If-Modified-Since"] = previous.last_modified
+        try:
+            async with self._host_limit(url):
+                response = await client.get(url, headers=headers)
+        except httpx.HTTPError as e:
+            print(f"Crawl failed for {url}: {e}")
+            manifest.failed.append(url)
+            return previous
+
+        if response.status_code == 304 and previous is not None:
+            manifest.unchanged.append(url)
+            return previous
+        if not response.is_success or "html" not in response.headers.get("content-type", "html"):
+            manifest.failed.append(url)
+            return previous
+
+        # Parsing is CPU-bound, so keep it off the event loop
+        text, links = await asyncio.to_thread(extract, response.content, str(response.url))
+        record = PageRecord(
+            url,
+            etag=response.headers.get("etag", ""),
+            last_modified=response.headers.get("last-modified", ""),
+            content_hash=hashlib.sha256(text.encode("utf-8")).hexdigest(),
+            text=text,
+            links=sorted({link for link in links if self._in_scope(link)}),
+            fetched_at=time.time(),
+        )
+        if previous is None:
+            manifest.added.append(url)
+        elif previous.content_hash != record.content_hash:
+            manifest.changed.append(url)
+        else:
+            manifest.unchanged.append(url)
+        return record
+
+    async def crawl(self) -> CrawlManifest:
+        """Walk the site, update the page store and return the manifest."""
+        previous = self.store.pages()
+        # Semaphores bind to the running loop, so each crawl gets fresh ones
+        self._host_slots = defaultdict(lambda: asyncio.Semaphore(self.per_host))
+        manifest = CrawlManifest(self.start_url)
+        seen = {self.start_url}
+        records: dict[str, PageRecord] = {}
+
+        async with httpx.AsyncClient(timeout=self.timeout, follow_redirects=True) as client:
+            async with asyncio.TaskGroup() as group:
+                async def visit(url: str, depth: int):
+                    # An exception escaping here would cancel every sibling task
+                    # in the group, so a bad page is logged and counted instead
+                    try:
+                        record = await self._fetch(client, url, previous.get(url), manifest)
+                    except Exception as e:
+                        print(f"Crawl failed for {url}: {e!r}")
+                        manifest.failed.append(url)
+                        record = previous.get(url)
+                    if record is None:
+                        return
+                    records[url] = record
+                    if depth >= self.max_depth:
+                        return
+                    for link in record.links:
+                        if link not in seen:
+                            seen.add(link)
+                            group.create_task(visit(link, depth + 1))
+
+                group.create_task(visit(self.start_url, 0))
+
+        # Pages that failed this time are kept; pages no longer linked are dropped
+        manifest.removed = [url for url in previous if url not in seen]
+        self.store.save(list(records.values()), manifest.removed)
+        manifest.finished_at = time.time()
+
+        if self.manifest_path:
+            if os.path.dirname(self.manifest_path):
+                os.makedirs(os.path.dirname(self.manifest_path), exist_ok=True)
+            with open(self.manifest_path, "w", encoding="utf-8") as f:
+                json.dump(manifest.to_dict(), f, indent=2)
+        return manifest
+
+    def crawl_sync(self) -> CrawlManifest:
+        """crawl() for sync callers, including ones already inside an event loop's thread."""
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(self.crawl())
+        result = {}
+        worker = threading.Thread(target=lambda: result.update(manifest=asyncio.run(self.crawl())))
+        worker.start()
+        worker.join()
+        if "manifest" not in result:
+            raise RuntimeError(f"Crawl of {self.start_url} failed")
+        return result["manifest"]
+
+
+if __name__ == "__main__":
+    # e.g. python -m http.server 8000 -d site/, then:
+    # python -m chat.doc_crawler http://localhost:8000/ /tmp/pages.sqlite
+    url, path = sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else "cache/docs_pages.sqlite"
+    print(json.dumps(DocCrawler(url, PageStore(path)).crawl_sync().to_dict(), indent=2))
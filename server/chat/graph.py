@@ -3,62 +3,175 @@
 import os
 import sys
 import ast
+import asyncio
 from typing import Annotated, Literal
 from dotenv import load_dotenv
 
 from pydantic import BaseModel
 from typing_extensions import TypedDict
-from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
 from langgraph.graph.message import add_messages
-from langgraph.graph import StateGraph
-from langgraph.checkpoint.memory import MemorySaver
+from langgraph.graph import StateGraph, END
+from langgraph.checkpoint.base import BaseCheckpointSaver
 from langgraph.graph.state import CompiledStateGraph
 from langgraph.prebuilt import ToolNode, tools_condition
-from langchain_deepseek import ChatDeepSeek
+from langgraph.utils.runnable import RunnableCallable
 from langchain_core.tools import tool
 from langchain_core.runnables.config import RunnableConfig
+from chat.modes import modes
 from chat.tools import lcel_codegen, python_repl, tavily_search_tool
+from chat.prompt_cache import cache_stats
+from chat.scheduler import StreamTracker, scheduler, estimate_tokens, request_info
+from chat.response_cache import maybe_cached, CachedChatModel
+from chat.cancellation import cancellations
 
 load_dotenv()
 
 
+def merge_files(left: dict, right: dict) -> dict:
+    # Insertion order is kept, so new files extend the files block at its end
+    return {**(left or {}), **(right or {})}
+
 class PydanticState(BaseModel):
     messages: Annotated[list, add_messages]
+    context_files: Annotated[dict, merge_files] = {}
+    mode: str | None = None
 
 class State(TypedDict):
     messages: Annotated[list, add_messages]
-
-def init_graph(tid: str, memory: MemorySaver, sys_msg: str | None = None, human_msg: str | None = None) -> CompiledStateGraph:
+    context_files: Annotated[dict, merge_files]
+    mode: str | None
+
+def build_prompt(state: State) -> list:
+    """
+    Lay the prompt out so large stable blocks form a byte-identical prefix for
+    provider-side prefix caching: loaded files first (append-only), then the
+    mode persona, then any system messages from history in their original
+    order, then the conversation. The persona is injected here at call time
+    and never stored in the message history.
+    """
+    prefix = []
+    if files := state.get("context_files"):
+        block = "".join(f"[FILE: {name}]\n{content}\n\n" for name, content in files.items())
+        prefix.append(SystemMessage(content=block))
+    if persona := modes.get(state.get("mode") or "default"):
+        prefix.append(SystemMessage(content=persona))
+
+    history = state["messages"]
+    system = [m for m in history if isinstance(m, SystemMessage)]
+    rest = [m for m in history if not isinstance(m, SystemMessage)]
+    return prefix + system + rest
+
+def route_tools(state: PydanticState) -> str:
+    # Like tools_condition, but a state with no messages yet (e.g. only the mode
+    # or files slot was updated) routes to END instead of raising
+    if not state.messages:
+        return END
+    return tools_condition(state)
+
+async def close_open_tool_calls(graph: CompiledStateGraph, config: RunnableConfig) -> int:
+    """
+    A turn cancelled during a tool call leaves the checkpoint ending in an
+    AIMessage whose tool calls were never answered, which providers reject on
+    the next turn. Answer each open call with a "cancelled" ToolMessage,
+    written as the tools node. Returns how many calls were closed.
+    """
+    snapshot = await graph.aget_state(config)
+    answered = set()
+    for message in reversed(snapshot.values.get("messages", [])):
+        if isinstance(message, ToolMessage):
+            answered.add(message.tool_call_id)
+        elif isinstance(message, AIMessage):
+            open_calls = [call for call in message.tool_calls if call["id"] not in answered]
+            break
+    else:
+        return 0
+    if open_calls:
+        await graph.aupdate_state(config, {"messages": [
+            ToolMessage(content="Cancelled: the user stopped this turn before the tool finished.",
+                        tool_call_id=call["id"], name=call["name"])
+            for call in open_calls
+        ]}, as_node="tools")
+    return len(open_calls)
+
+def init_graph(tid: str, memory: BaseCheckpointSaver, mode: str | None = None) -> CompiledStateGraph:
     # memory = MemorySaver()
     graph_builder = StateGraph(PydanticState)
 
     tools_list = [tavily_search_tool, python_repl, lcel_codegen]
 
-    llm = ChatDeepSeek(
+    # Imported here: the provider client stack is the slowest part of startup
+    from langchain_deepseek import ChatDeepSeek
+
+    llm = maybe_cached(ChatDeepSeek(
         model="deepseek-chat",
         temperature=0.0,
         streaming=True,
-    )
+        stream_usage=True,
+        max_retries=0,  # Retries are handled by the scheduler
+    ))
     llm_with_tools = llm.bind_tools(tools_list)
 
-    def chatbot(state: State):
-        return {"messages": [llm_with_tools.invoke(state["messages"])]}
+    def chatbot(state: State, config: RunnableConfig):
+        prompt = build_prompt(state)
+        session_id, priority = request_info(config)
+        tracker = StreamTracker()
+        call = lambda: llm_with_tools.with_config(callbacks=[tracker]).invoke(prompt, config)
+        if isinstance(llm, CachedChatModel) and llm.is_cached(prompt, **llm_with_tools.kwargs):
+            # Replayed locally, no provider capacity needed
+            return {"messages": [call()]}
+        response = scheduler.submit(
+            call, session_id=session_id, priority=priority, tokens=estimate_tokens(prompt),
+            output_started=tracker.started,
+        )
+        cache_stats.record("chatbot", response)
+        return {"messages": [response]}
+
+    async def achatbot(state: State, config: RunnableConfig):
+        # Async twin used by astream/ainvoke: cancelling the turn cancels this
+        # coroutine, which closes the provider HTTP stream instead of letting a
+        # worker thread read it to the end
+        prompt = build_prompt(state)
+        session_id, priority = request_info(config)
+        started = False
+        tracker = StreamTracker()
+
+        async def call():
+            nonlocal started
+            started = True
+            return await llm_with_tools.with_config(callbacks=[tracker]).ainvoke(prompt, config)
+
+        # The cache lookup is a blocking SQLite query, so it stays off the event loop
+        if isinstance(llm, CachedChatModel) and await asyncio.to_thread(
+            llm.is_cached, prompt, **llm_with_tools.kwargs
+        ):
+            return {"messages": [await call()]}
+        try:
+            response = await scheduler.asubmit(
+                call, session_id=session_id, priority=priority, tokens=estimate_tokens(prompt),
+                output_started=tracker.started,
+            )
+        except asyncio.CancelledError:
+            # Only a call that reached the provider had a stream to abort
+            cancellations.record("llm_streams_aborted" if started else "llm_requests_dequeued")
+            raise
+        cache_stats.record("chatbot", response)
+        return {"messages": [response]}
 
     tool_node = ToolNode(tools=tools_list)
 
-    graph_builder.add_node("chatbot", chatbot)
+    graph_builder.add_node("chatbot", RunnableCallable(chatbot, achatbot), input=State)
     graph_builder.add_node("tools", tool_node)
 
-    graph_builder.add_conditional_edges("chatbot", tools_condition)
+    graph_builder.add_conditional_edges("chatbot", route_tools, {"tools": "tools", END: END})
     graph_builder.add_edge("tools", "chatbot")
     graph_builder.set_entry_point("chatbot")
 
     graph = graph_builder.compile(checkpointer=memory)
     config: RunnableConfig = {"configurable": {"thread_id": tid}}
 
-    if sys_msg:
-        graph.ainvoke({"messages": [SystemMessage(content=sys_msg)]}, config)
-    if human_msg:
-        graph.ainvoke({"messages": [HumanMessage(content=human_msg)]}, config)
+    if mode:
+        # Only sets the state slot; no LLM call, nothing added to history
+        graph.update_state(config, {"mode": mode}, as_node="chatbot")
 
     return graph
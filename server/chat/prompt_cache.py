@@ -0,0 +1,49 @@
+# chat/prompt_cache.py
+
+import threading
+import time
+from collections import deque
+
+
+def cache_tokens(message) -> tuple[int, int]:
+    """
+    (hit, miss) prompt tokens for one LLM response. DeepSeek reports
+    prompt_cache_hit_tokens / prompt_cache_miss_tokens in the raw usage; other
+    providers surface cached tokens as usage_metadata.input_token_details.cache_read.
+    """
+    usage = (getattr(message, "response_metadata", None) or {}).get("token_usage") or {}
+    if "prompt_cache_hit_tokens" in usage:
+        return usage["prompt_cache_hit_tokens"], usage.get("prompt_cache_miss_tokens", 0)
+
+    usage_metadata = getattr(message, "usage_metadata", None) or {}
+    input_tokens = usage_metadata.get("input_tokens", 0)
+    hit = (usage_metadata.get("input_token_details") or {}).get("cache_read", 0) or 0
+    return hit, max(input_tokens - hit, 0)
+
+
+class PromptCacheStats:
+    """Process-wide prompt-cache hit/miss counters, per call site."""
+
+    def __init__(self, history: int = 200):
+        self._lock = threading.Lock()
+        self.totals: dict[str, dict[str, int]] = {}
+        self.recent = deque(maxlen=history)
+
+    def record(self, source: str, message) -> tuple[int, int]:
+        hit, miss = cache_tokens(message)
+        with self._lock:
+            totals = self.totals.setdefault(source, {"calls": 0, "hit": 0, "miss": 0})
+            totals["calls"] += 1
+            totals["hit"] += hit
+            totals["miss"] += miss
+            self.recent.append({"source": source, "hit": hit, "miss": miss, "at": time.time()})
+        if hit or miss:
+            print(f"[prompt-cache] {source}: {hit} hit / {miss} miss tokens ({hit / (hit + miss):.0%})")
+        return hit, miss
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {source: dict(t) for source, t in self.totals.items()}
+
+
+cache_stats = PromptCacheStats()
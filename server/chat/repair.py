@@ -0,0 +1,124 @@
+# chat/repair.py
+
+import json
+import re
+from typing import Optional
+
+from pydantic import BaseModel, ValidationError
+
+
+# Only closed fences: an unterminated one means the code was cut off
+FENCE_RE = re.compile(r"```[ \t]*(?:python|py)?[ \t]*\n(.*?)```", re.DOTALL)
+
+
+def close_json(text: str) -> str:
+    """
+    Close arrays and objects left open by a truncated JSON string. A string
+    value cut off mid-way is left open (so the result does not parse): closing
+    it would turn truncated code into a plausible-looking answer.
+    """
+    stack = []
+    in_string = False
+    escaped = False
+    for ch in text:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]" and stack:
+            stack.pop()
+
+    if in_string:
+        return text
+    repaired = re.sub(r",\s*$", "", text)
+    return repaired + "".join(reversed(stack))
+
+
+def _load_json(text: str) -> Optional[dict]:
+    text = text.strip()
+    start = text.find("{")
+    if start == -1:
+        return None
+    text = text[start:]
+    for candidate in (text, close_json(text)):
+        try:
+            data = json.loads(candidate)
+        except ValueError:
+            continue
+        if isinstance(data, dict):
+            return data
+    return None
+
+
+def _split_imports(code: str) -> tuple[str, str]:
+    imports, body = [], []
+    for line in code.splitlines():
+        if re.match(r"\s*(import\s|from\s+\S+\s+import\s)", line) and not line.startswith((" ", "\t")):
+            imports.append(line)
+        else:
+            body.append(line)
+    return "\n".join(imports), "\n".join(body).strip("\n")
+
+
+def _from_fenced(content: str) -> Optional[dict]:
+    blocks = FENCE_RE.findall(content)
+    if not blocks:
+        return None
+    imports, code = _split_imports("\n\n".join(b.strip("\n") for b in blocks))
+    prefix = content[:content.find("```")].strip() or "Solution"
+    return {"prefix": prefix, "imports": imports, "code": code}
+
+
+def _compiles(solution: BaseModel) -> bool:
+    imports = getattr(solution, "imports", "")
+    code = getattr(solution, "code", None)
+    if code is None:
+        return True
+    try:
+        compile(f"{imports}\n{code}", "<repaired>", "exec")
+        return True
+    except (SyntaxError, ValueError):
+        return False
+
+
+def repair_structured_output(raw, schema: type[BaseModel]) -> Optional[BaseModel]:
+    """
+    Try to recover a `schema` instance from an AIMessage whose structured output
+    failed to parse, without another LLM call. Handles, in order:
+    malformed tool-call arguments, JSON in the message text, and code written
+    as fenced blocks instead of tool arguments. Output cut off by the token
+    limit is not repaired, and a repaired solution must compile.
+    """
+    metadata = getattr(raw, "response_metadata", None) or {}
+    if metadata.get("finish_reason") == "length":
+        return None
+
+    candidates = []
+    for call in getattr(raw, "invalid_tool_calls", None) or []:
+        if isinstance(call.get("args"), str):
+            candidates.append(_load_json(call["args"]))
+    for call in getattr(raw, "tool_calls", None) or []:
+        candidates.append(call.get("args"))
+
+    content = getattr(raw, "content", "")
+    if isinstance(content, str) and content:
+        candidates.append(_load_json(content))
+        candidates.append(_from_fenced(content))
+
+    for data in candidates:
+        if not data:
+            continue
+        try:
+            solution = schema(**data)
+        except (ValidationError, TypeError):
+            continue
+        if _compiles(solution):
+            return solution
+    return None
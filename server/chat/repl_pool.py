@@ -0,0 +1,211 @@
+# chat/repl_pool.py
+
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+from multiprocessing.connection import Connection
+
+from chat.cancellation import cancellations
+
+# Directory holding the `chat` package, so workers can run `-m chat.repl_worker`
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class ReplWorker:
+    """
+    One worker process running chat.repl_worker, connected over a socket pair.
+    It is started as its own program rather than a multiprocessing spawn child,
+    which would re-import the server's __main__ module in every worker.
+    """
+
+    def __init__(self, memory_mb: int, cpu_seconds: int):
+        parent_sock, child_sock = socket.socketpair()
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, [SERVER_DIR, env.get("PYTHONPATH")]))
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "chat.repl_worker",
+             str(child_sock.fileno()), str(memory_mb), str(cpu_seconds)],
+            pass_fds=(child_sock.fileno(),),
+            env=env,
+        )
+        child_sock.close()
+        self.conn = Connection(parent_sock.detach())
+        self.lock = threading.Lock()
+        self.last_used = time.time()
+        self.cancelled = False
+        self.leases = 0  # Calls holding this worker; guarded by the pool lock
+
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def run_batch(self, cells: list[str], stop_on_error: bool, timeout: float, results: list):
+        """Fill `results` as cells finish, so a timeout keeps the finished ones."""
+        self.conn.send((cells, stop_on_error))
+        for _ in cells:
+            if not self.conn.poll(timeout):
+                raise TimeoutError
+            results.append(self.conn.recv())
+
+    def run(self, code: str, timeout: float) -> str:
+        self.conn.send(code)
+        if not self.conn.poll(timeout):
+            raise TimeoutError
+        return self.conn.recv()
+
+    def kill(self):
+        if self.alive():
+            self.process.kill()
+        try:
+            self.process.wait(timeout=1)
+        except subprocess.TimeoutExpired:
+            pass
+        self.conn.close()
+
+
+class ReplPool:
+    """
+    Long-lived Python worker processes leased per thread_id. Each worker keeps
+    its globals between calls. A snippet that runs past `timeout` gets its
+    worker killed and respawned (losing that thread's state). When the pool is
+    full, the least recently used idle worker is retired; if every worker is
+    running a call, a new session waits up to `timeout` for one to finish and
+    is then turned away as busy.
+    """
+
+    def __init__(self, max_workers: int = 4, timeout: float = 30.0,
+                 memory_mb: int = 1024, cpu_seconds: int = 600):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.memory_mb = memory_mb
+        self.cpu_seconds = cpu_seconds
+        self._workers: "OrderedDict[str, ReplWorker]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._freed = threading.Condition(self._lock)  # A lease ended or a worker was retired
+
+    def _lease(self, thread_id: str) -> Optional[ReplWorker]:
+        """
+        The thread's worker, marked leased under the pool lock so no other
+        lease can retire it before the caller runs. Returns None if the pool
+        stayed full of leased workers for `timeout`.
+        """
+        deadline = time.monotonic() + self.timeout
+        with self._freed:
+            while True:
+                worker = self._workers.get(thread_id)
+                if worker is not None and worker.alive():
+                    self._workers.move_to_end(thread_id)
+                    worker.leases += 1
+                    return worker
+                if worker is not None:
+                    self._workers.pop(thread_id).kill()
+                if len(self._workers) < self.max_workers:
+                    break
+                idle = next((key for key, w in self._workers.items() if not w.leases), None)
+                if idle is not None:
+                    self._workers.pop(idle).kill()
+                    continue
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._freed.wait(remaining)
+            worker = ReplWorker(self.memory_mb, self.cpu_seconds)
+            worker.leases = 1
+            self._workers[thread_id] = worker
+            return worker
+
+    def _unlease(self, worker: ReplWorker):
+        with self._freed:
+            worker.leases -= 1
+            self._freed.notify_all()
+
+    def _retire(self, thread_id: str, worker: ReplWorker):
+        with self._freed:
+            if self._workers.get(thread_id) is worker:
+                del self._workers[thread_id]
+                self._freed.notify_all()
+        worker.kill()
+
+    def _cancel(self, thread_id: str, worker: ReplWorker):
+        worker.cancelled = True
+        self._retire(thread_id, worker)
+
+    def _submit(self, thread_id: str, call):
+        """
+        Run call(worker) on the thread's worker. Returns (reply, None, None) or,
+        if the call did not complete, (None, status, error text) with status
+        busy, timeout, cancelled or error.
+        """
+        worker = self._lease(thread_id)
+        if worker is None:
+            return None, "busy", (f"PoolBusy: all {self.max_workers} REPL workers are running other "
+                                  "sessions' code; nothing was run, try again shortly.")
+        try:
+            with worker.lock, cancellations.track(thread_id, "repl_workers_killed", lambda: self._cancel(thread_id, worker)):
+                worker.last_used = time.time()
+                try:
+                    return call(worker), None, None
+                except TimeoutError:
+                    self._retire(thread_id, worker)
+                    return None, "timeout", (f"TimeoutError: execution exceeded {self.timeout}s; "
+                                             "the REPL was restarted and its state cleared.")
+                except (EOFError, OSError):
+                    self._retire(thread_id, worker)
+                    if worker.cancelled:
+                        return None, "cancelled", "Cancelled: the turn was stopped; the REPL was restarted and its state cleared."
+                    return None, "error", ("WorkerError: the REPL process died (likely a memory or CPU limit); "
+                                           "its state was cleared.")
+        finally:
+            self._unlease(worker)
+
+    def run(self, thread_id: str, code: str) -> str:
+        output, _, error = self._submit(thread_id, lambda worker: worker.run(code, self.timeout))
+        return error or output
+
+    def run_batch(self, thread_id: str, cells: list[str], stop_on_error: bool = True) -> list[tuple[str, str]]:
+        """
+        Run several cells in the thread's worker with one round trip; returns
+        (status, output) per cell, status being ok, error, busy, timeout,
+        cancelled or skipped. Each cell gets its own `timeout`. If a cell kills the worker,
+        the cells before it keep their output and the ones after are skipped.
+        """
+        results = []
+        _, status, error = self._submit(
+            thread_id, lambda worker: worker.run_batch(cells, stop_on_error, self.timeout, results)
+        )
+        if error:
+            results.append((status, error))
+            results += [("skipped", "")] * (len(cells) - len(results))
+        return results
+
+    async def arun(self, thread_id: str, code: str) -> str:
+        return await asyncio.to_thread(self.run, thread_id, code)
+
+    async def arun_batch(self, thread_id: str, cells: list[str], stop_on_error: bool = True) -> list[tuple[str, str]]:
+        return await asyncio.to_thread(self.run_batch, thread_id, cells, stop_on_error)
+
+    def release(self, thread_id: str):
+        with self._freed:
+            worker = self._workers.pop(thread_id, None)
+            self._freed.notify_all()
+        if worker is not None:
+            worker.kill()
+
+    def shutdown(self):
+        with self._lock:
+            workers = list(self._workers.values())
+            self._workers.clear()
+        for worker in workers:
+            worker.kill()
+
+
+repl_pool = ReplPool(
+    max_workers=int(os.environ.get("REPL_POOL_SIZE", "4")),
+    timeout=float(os.environ.get("REPL_TIMEOUT", "30")),
+    memory_mb=int(os.environ.get("REPL_MEMORY_MB", "1024")),
+)
@@ -0,0 +1,69 @@
+# chat/repl_worker.py
+#
+# Entry module for ReplPool workers, started as `python -m chat.repl_worker`.
+# It imports only the standard library, so a worker does not pay for (or
+# re-run) the server's imports the way a multiprocessing spawn child
+# re-importing __main__ would.
+
+import contextlib
+import io
+import os
+import sys
+from multiprocessing.connection import Connection
+
+
+def _set_limits(memory_mb: int, cpu_seconds: int):
+    try:
+        import resource
+    except ImportError:  # Not available on Windows
+        return
+    if memory_mb:
+        limit = memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    if cpu_seconds:
+        # Lifetime CPU budget for the worker; exceeding it kills the worker,
+        # which the pool then respawns
+        resource.setrlimit(resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds))
+
+
+def worker_main(conn: Connection, memory_mb: int, cpu_seconds: int):
+    """Child process loop: exec snippets in one persistent globals dict."""
+    _set_limits(memory_mb, cpu_seconds)
+    with contextlib.suppress(OSError):
+        os.nice(10)  # Stay behind the chat server for CPU
+    namespace = {"__name__": "__main__"}
+
+    def run_cell(code: str) -> tuple[bool, str]:
+        buffer = io.StringIO()
+        try:
+            with contextlib.redirect_stdout(buffer):
+                exec(code, namespace)
+            return True, buffer.getvalue()
+        except BaseException as e:
+            return False, buffer.getvalue() + repr(e)
+
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            break
+        if isinstance(request, str):
+            conn.send(run_cell(request)[1])
+            continue
+        # Batch: (cells, stop_on_error) -> one (status, output) message per cell,
+        # sent as each finishes so the parent can time every cell separately
+        cells, stop_on_error = request
+        failed = False
+        for code in cells:
+            if stop_on_error and failed:
+                conn.send(("skipped", ""))
+                continue
+            ok, output = run_cell(code)
+            failed = failed or not ok
+            conn.send(("ok" if ok else "error", output))
+
+
+if __name__ == "__main__":
+    # argv: <socket fd inherited from the pool> <memory_mb> <cpu_seconds>
+    fd, memory_mb, cpu_seconds = (int(arg) for arg in sys.argv[1:4])
+    worker_main(Connection(fd), memory_mb, cpu_seconds)
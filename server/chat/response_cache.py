@@ -0,0 +1,179 @@
+# chat/response_cache.py
+
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import aclosing
+from typing import Any, AsyncIterator, Iterator, Optional
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel, agenerate_from_stream, generate_from_stream
+from langchain_core.messages import BaseMessage, message_to_dict, messages_from_dict
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+
+
+def _message_key(message: BaseMessage) -> dict:
+    # IDs and provider metadata change on every run, so they stay out of the key
+    return message.model_dump(exclude={"id", "response_metadata", "usage_metadata"})
+
+
+class ResponseCache:
+    """SQLite store of streamed replies (as chunk lists), trimmed to `max_entries` by LRU."""
+
+    def __init__(self, path: str, max_entries: int = 5000):
+        self.max_entries = max_entries
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                chunks TEXT NOT NULL,
+                last_used REAL NOT NULL
+            )"""
+        )
+        self._conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def contains(self, key: str) -> bool:
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM responses WHERE key = ?", (key,)).fetchone() is not None
+
+    def get(self, key: str) -> Optional[list]:
+        with self._lock:
+            row = self._conn.execute("SELECT chunks FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            return json.loads(row[0])
+
+    def put(self, key: str, chunks: list):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?)",
+                (key, json.dumps(chunks), time.time()),
+            )
+            self._conn.execute(
+                """DELETE FROM responses WHERE key NOT IN (
+                    SELECT key FROM responses ORDER BY last_used DESC LIMIT ?
+                )""",
+                (self.max_entries,),
+            )
+            self._conn.commit()
+
+
+class CachedChatModel(BaseChatModel):
+    """
+    Wraps a deterministic (temperature 0) chat model. Replies are keyed by model
+    parameters, bound tool schemas and the message history. A hit is replayed
+    through _stream chunk by chunk, so streaming consumers see the same chunks
+    they would get from the provider, only without the wait. _astream delegates
+    to the provider's async stream, so cancelling the caller closes the HTTP
+    stream; a reply cut short that way is not cached.
+    """
+
+    inner: BaseChatModel
+    store: Any
+
+    @property
+    def _llm_type(self) -> str:
+        return f"cached-{self.inner._llm_type}"
+
+    def cache_key(self, messages: list[BaseMessage], stop: Optional[list[str]] = None, **kwargs: Any) -> str:
+        payload = {
+            "llm": self.inner._get_llm_string(stop=stop, **kwargs),
+            "messages": [_message_key(m) for m in messages],
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def is_cached(self, messages: list[BaseMessage], **kwargs: Any) -> bool:
+        return self.store.contains(self.cache_key(messages, **kwargs))
+
+    def bind_tools(self, tools, **kwargs):
+        # Let the provider model format the tools, then bind them to the wrapper
+        return self.bind(**self.inner.bind_tools(tools, **kwargs).kwargs)
+
+    def _stream(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        key = self.cache_key(messages, stop=stop, **kwargs)
+        if (cached := self.store.get(key)) is not None:
+            for chunk in cached:
+                yield ChatGenerationChunk(message=messages_from_dict([chunk["message"]])[0], generation_info=chunk["info"])
+            return
+
+        chunks = []
+        for chunk in self.inner._stream(messages, stop=stop, run_manager=None, **kwargs):
+            chunks.append({"message": message_to_dict(chunk.message), "info": chunk.generation_info})
+            yield chunk
+        self.store.put(key, chunks)
+
+    def _generate(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        return generate_from_stream(self._stream(messages, stop=stop, **kwargs))
+
+    async def _astream(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        key = self.cache_key(messages, stop=stop, **kwargs)
+        # The store is blocking SQLite, so it stays off the event loop
+        if (cached := await asyncio.to_thread(self.store.get, key)) is not None:
+            for chunk in cached:
+                yield ChatGenerationChunk(message=messages_from_dict([chunk["message"]])[0], generation_info=chunk["info"])
+            return
+
+        chunks = []
+        async with aclosing(self.inner._astream(messages, stop=stop, run_manager=None, **kwargs)) as stream:
+            async for chunk in stream:
+                chunks.append({"message": message_to_dict(chunk.message), "info": chunk.generation_info})
+                yield chunk
+        await asyncio.to_thread(self.store.put, key, chunks)
+
+    async def _agenerate(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        return await agenerate_from_stream(self._astream(messages, stop=stop, **kwargs))
+
+
+_store: Optional[ResponseCache] = None
+
+def maybe_cached(llm: BaseChatModel) -> BaseChatModel:
+    """Wrap llm in the response cache if LLM_RESPONSE_CACHE is set and llm is deterministic."""
+    global _store
+    if os.environ.get("LLM_RESPONSE_CACHE", "0").lower() not in ("1", "true", "yes"):
+        return llm
+    if getattr(llm, "temperature", None) not in (0, 0.0):
+        return llm
+    if _store is None:
+        _store = ResponseCache(
+            os.environ.get("LLM_RESPONSE_CACHE_PATH", "cache/llm_responses.sqlite"),
+            max_entries=int(os.environ.get("LLM_RESPONSE_CACHE_SIZE", "5000")),
+        )
+    return CachedChatModel(inner=llm, store=_store)
@@ -0,0 +1,103 @@
+# chat/sandbox_client.py
+
+import os
+import re
+
+import httpx
+
+from chat.cancellation import cancellations
+
+# Set to run python_repl in the Jupyter sandbox instead of the local worker pool
+SANDBOX_URL = os.environ.get("SANDBOX_URL", "")
+
+_ANSI_RE = re.compile(r"\x1b\[[0-9;]*m")
+
+# sandbox.pool.SandboxPool set by use_pool(); takes precedence over SANDBOX_URL
+_pool = None
+
+
+def use_pool(pool):
+    """Route every user to its instance in `pool` (None goes back to SANDBOX_URL)."""
+    global _pool
+    _pool = pool
+
+
+def enabled() -> bool:
+    return _pool is not None or bool(SANDBOX_URL)
+
+
+def base_url(user_id: str) -> str:
+    if _pool is not None:
+        return _pool.route(user_id)
+    return SANDBOX_URL
+
+
+def _post(user_id: str, path: str, timeout: float, **kwargs) -> httpx.Response:
+    url = base_url(user_id)
+    resp = httpx.post(f"{url}{path}", timeout=timeout, **kwargs)
+    if resp.status_code == 404:
+        # No kernel for this user yet (or it was ended, e.g. moved by a pool
+        # resize): start one and retry once
+        httpx.post(f"{url}/start_session", data={"user_id": user_id}, timeout=60).raise_for_status()
+        resp = httpx.post(f"{url}{path}", timeout=timeout, **kwargs)
+    return resp
+
+
+def interrupt(user_id: str):
+    """Ask the sandbox to interrupt the session's running kernel cell."""
+    httpx.post(f"{base_url(user_id)}/interrupt", data={"user_id": user_id}, timeout=5).raise_for_status()
+
+
+def execute(user_id: str, code: str, timeout: float = 300) -> dict:
+    """
+    Run code in the user's sandbox kernel. While the request is in flight the
+    session can be cancelled, which interrupts the kernel instead of leaving
+    the cell running after the user has moved on.
+    """
+    with cancellations.track(user_id, "kernels_interrupted", lambda: interrupt(user_id)):
+        resp = _post(user_id, "/execute", timeout, json={"user_id": user_id, "code": code})
+    return resp.json()
+
+
+def run_code(user_id: str, code: str) -> str:
+    """execute() formatted as tool output: the printed output, or the error."""
+    try:
+        result = execute(user_id, code)
+    except httpx.HTTPError as e:
+        return f"SandboxError: {e}"
+    detail = result.get("detail")
+    if detail is None:
+        return result.get("output", "")
+    if isinstance(detail, dict) and "traceback" in detail:
+        return _ANSI_RE.sub("", "\n".join(detail["traceback"]))
+    return f"SandboxError: {detail}"
+
+
+def execute_batch(user_id: str, cells: list[str], stop_on_error: bool = True,
+                  cell_timeout: float = 10, timeout: float = 300) -> dict:
+    """
+    Run several dependent cells in one request. The sandbox queues them all on
+    the kernel at once and returns {"results": [{"status", "output", ...}]},
+    one entry per cell; status is ok, error, timeout or skipped.
+    """
+    with cancellations.track(user_id, "kernels_interrupted", lambda: interrupt(user_id)):
+        resp = _post(
+            user_id, "/execute_batch", timeout,
+            json={"user_id": user_id, "cells": cells,
+                  "stop_on_error": stop_on_error, "cell_timeout": cell_timeout},
+        )
+    return resp.json()
+
+
+def run_cells(user_id: str, cells: list[str], stop_on_error: bool = True) -> list[tuple[str, str]]:
+    """execute_batch() as (status, output) per cell, tracebacks folded into the output."""
+    try:
+        result = execute_batch(user_id, cells, stop_on_error)
+    except httpx.HTTPError as e:
+        return [("error", f"SandboxError: {e}")] + [("skipped", "")] * (len(cells) - 1)
+    if "results" not in result:
+        return [("error", f"SandboxError: {result.get('detail')}")] + [("skipped", "")] * (len(cells) - 1)
+    return [
+        (cell["status"], cell["output"] + _ANSI_RE.sub("", "\n".join(cell.get("traceback", []))))
+        for cell in result["results"]
+    ]
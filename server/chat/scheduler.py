@@ -0,0 +1,298 @@
+# chat/scheduler.py
+
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Awaitable, Callable, Optional, TypeVar
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+T = TypeVar("T")
+
+INTERACTIVE = 0
+BACKGROUND = 1
+PRIORITIES = {"interactive": INTERACTIVE, "background": BACKGROUND}
+
+
+class SchedulerBusy(RuntimeError):
+    """Raised when the queue is full; callers should surface it rather than wait."""
+
+
+def estimate_tokens(messages, completion: int = 512) -> int:
+    """Rough prompt size (~4 chars per token) plus an allowance for the reply."""
+    chars = 0
+    for m in messages:
+        content = getattr(m, "content", m[1] if isinstance(m, tuple) else m)
+        chars += len(str(content))
+    return chars // 4 + completion
+
+
+# Provider (openai SDK) and httpx errors worth another attempt. Matched by name
+# so this module does not import either client.
+_TRANSIENT_ERRORS = {
+    "RateLimitError", "APIConnectionError", "APITimeoutError", "InternalServerError",
+    "TimeoutException", "TransportError",
+}
+
+
+def is_retryable(e: Exception) -> bool:
+    """Rate limits, 5xx responses, timeouts and dropped connections. The model
+    clients run with max_retries=0, so these are retried here or not at all."""
+    status = getattr(e, "status_code", None)
+    if status == 429 or (isinstance(status, int) and status >= 500):
+        return True
+    return any(cls.__name__ in _TRANSIENT_ERRORS for cls in type(e).__mro__)
+
+
+class StreamTracker(BaseCallbackHandler):
+    """
+    Notes whether a model call has streamed any token yet. Pass
+    `output_started=tracker.started` to submit()/asubmit(): a failure after
+    that point is not retried, since the partial reply has already reached
+    the client and a retry would stream it again from the start.
+    """
+
+    run_inline = True  # Set the flag before the next chunk, not from an executor
+
+    def __init__(self):
+        self.streamed = False
+
+    def on_llm_new_token(self, token: str, **kwargs):
+        self.streamed = True
+
+    def started(self) -> bool:
+        return self.streamed
+
+
+def _actual_tokens(result) -> int | None:
+    # AIMessage, or the {"raw": AIMessage, ...} dict from include_raw structured output
+    message = result.get("raw") if isinstance(result, dict) else result
+    usage = getattr(message, "usage_metadata", None) or {}
+    return usage.get("total_tokens")
+
+
+class _Ticket:
+    def __init__(self, session_id: str, priority: int, tokens: int):
+        self.session_id = session_id
+        self.priority = priority
+        self.tokens = tokens
+        self.enqueued_at = time.time()
+        self.granted = threading.Event()
+
+
+class LLMScheduler:
+    """
+    Process-wide gate for LLM calls.
+
+    - at most `max_concurrency` calls in flight
+    - a tokens-per-minute bucket (estimated up front, corrected from usage)
+    - fair queuing: sessions are served round-robin, so one busy session
+      cannot starve the others
+    - interactive calls are always dispatched before background ones
+    - rate limits and transient errors (5xx, timeouts, connection resets) are
+      retried with exponential backoff and full jitter
+    - at most `max_queue` waiting calls; beyond that SchedulerBusy is raised
+    """
+
+    def __init__(self, max_concurrency: int = 8, tokens_per_minute: int = 0,
+                 max_queue: int = 200, max_retries: int = 4, base_delay: float = 1.0):
+        self.max_concurrency = max_concurrency
+        self.tokens_per_minute = tokens_per_minute  # 0 = unlimited
+        self.max_queue = max_queue
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+
+        self._lock = threading.Lock()
+        self._queues: dict[int, "OrderedDict[str, deque[_Ticket]]"] = {
+            INTERACTIVE: OrderedDict(), BACKGROUND: OrderedDict(),
+        }
+        self._waiting = 0
+        self._running = 0
+        self._bucket = float(tokens_per_minute)
+        self._bucket_updated = time.monotonic()
+        self._last_wait: dict[str, float] = {}
+        self.stats = {"calls": 0, "retries": 0, "rejected": 0, "wait_total": 0.0}
+
+    # ---- token bucket ----
+    def _refill(self):
+        now = time.monotonic()
+        rate = self.tokens_per_minute / 60.0
+        self._bucket = min(self.tokens_per_minute, self._bucket + (now - self._bucket_updated) * rate)
+        self._bucket_updated = now
+
+    def _has_budget(self, tokens: int) -> bool:
+        if not self.tokens_per_minute:
+            return True
+        self._refill()
+        # A call larger than the whole budget still goes through once the bucket is full
+        return self._bucket >= min(tokens, self.tokens_per_minute)
+
+    # ---- dispatch ----
+    def _dispatch(self):
+        # Caller holds the lock
+        while self._running < self.max_concurrency:
+            ticket = self._next_ticket()
+            if ticket is None:
+                return
+            if self.tokens_per_minute:
+                self._bucket -= ticket.tokens
+            self._running += 1
+            self._waiting -= 1
+            ticket.granted.set()
+
+    def _next_ticket(self) -> _Ticket | None:
+        for priority in (INTERACTIVE, BACKGROUND):
+            sessions = self._queues[priority]
+            if not sessions:
+                continue
+            session_id, tickets = next(iter(sessions.items()))
+            if not self._has_budget(tickets[0].tokens):
+                return None
+            ticket = tickets.popleft()
+            # Round-robin: the session goes to the back of the line
+            del sessions[session_id]
+            if tickets:
+                sessions[session_id] = tickets
+            return ticket
+        return None
+
+    def _enqueue(self, ticket: _Ticket):
+        with self._lock:
+            if self._waiting >= self.max_queue:
+                self.stats["rejected"] += 1
+                raise SchedulerBusy("Too many pending model requests, try again shortly.")
+            self._queues[ticket.priority].setdefault(ticket.session_id, deque()).append(ticket)
+            self._waiting += 1
+            self._dispatch()
+
+    def _granted(self, ticket: _Ticket):
+        wait = time.time() - ticket.enqueued_at
+        with self._lock:
+            self._last_wait[ticket.session_id] = wait
+            self.stats["calls"] += 1
+            self.stats["wait_total"] += wait
+
+    def _withdraw(self, ticket: _Ticket):
+        """Drop a cancelled ticket: out of the queue if still waiting, else give its slot back."""
+        with self._lock:
+            if not ticket.granted.is_set():
+                tickets = self._queues[ticket.priority].get(ticket.session_id)
+                if tickets and ticket in tickets:
+                    tickets.remove(ticket)
+                    self._waiting -= 1
+                    if not tickets:
+                        del self._queues[ticket.priority][ticket.session_id]
+                return
+        self._release(ticket, None)
+
+    def _acquire(self, ticket: _Ticket):
+        self._enqueue(ticket)
+        # Poll so token-bucket refills are noticed without a timer thread
+        while not ticket.granted.wait(timeout=0.25):
+            with self._lock:
+                self._dispatch()
+        self._granted(ticket)
+
+    async def _aacquire(self, ticket: _Ticket):
+        self._enqueue(ticket)
+        try:
+            while not ticket.granted.is_set():
+                await asyncio.sleep(0.05)
+                with self._lock:
+                    self._dispatch()
+        except asyncio.CancelledError:
+            self._withdraw(ticket)
+            raise
+        self._granted(ticket)
+
+    def _release(self, ticket: _Ticket, actual_tokens: int | None):
+        with self._lock:
+            self._running -= 1
+            if self.tokens_per_minute and actual_tokens is not None:
+                self._bucket += ticket.tokens - actual_tokens
+            self._dispatch()
+
+    def submit(self, fn: Callable[[], T], *, session_id: str = "default",
+               priority: str = "interactive", tokens: int = 512,
+               output_started: Optional[Callable[[], bool]] = None) -> T:
+        """Run fn() once a slot and token budget are available, retrying transient
+        errors unless output_started() says fn already streamed part of a reply."""
+        ticket = _Ticket(session_id, PRIORITIES.get(priority, BACKGROUND), tokens)
+        self._acquire(ticket)
+        actual = None
+        try:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    result = fn()
+                    actual = _actual_tokens(result)
+                    return result
+                except Exception as e:
+                    if (not is_retryable(e) or attempt == self.max_retries
+                            or (output_started is not None and output_started())):
+                        raise
+                    with self._lock:
+                        self.stats["retries"] += 1
+                    delay = random.uniform(0, self.base_delay * 2 ** attempt)
+                    print(f"[scheduler] {type(e).__name__}, retrying in {delay:.1f}s")
+                    time.sleep(delay)
+        finally:
+            self._release(ticket, actual)
+
+    async def asubmit(self, fn: Callable[[], Awaitable[T]], *, session_id: str = "default",
+                      priority: str = "interactive", tokens: int = 512,
+                      output_started: Optional[Callable[[], bool]] = None) -> T:
+        """Async submit: cancelling the awaiting task leaves the queue or frees the
+        slot at once, and cancellation propagates into fn() (e.g. aborting an HTTP stream)."""
+        ticket = _Ticket(session_id, PRIORITIES.get(priority, BACKGROUND), tokens)
+        await self._aacquire(ticket)
+        actual = None
+        try:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    result = await fn()
+                    actual = _actual_tokens(result)
+                    return result
+                except Exception as e:
+                    if (not is_retryable(e) or attempt == self.max_retries
+                            or (output_started is not None and output_started())):
+                        raise
+                    with self._lock:
+                        self.stats["retries"] += 1
+                    delay = random.uniform(0, self.base_delay * 2 ** attempt)
+                    print(f"[scheduler] {type(e).__name__}, retrying in {delay:.1f}s")
+                    await asyncio.sleep(delay)
+        finally:
+            self._release(ticket, actual)
+
+    # ---- introspection ----
+    def queue_status(self, session_id: str) -> dict | None:
+        """Position and wait so far of the session's oldest queued call, or None."""
+        with self._lock:
+            now = time.time()
+            position = 0
+            for priority in (INTERACTIVE, BACKGROUND):
+                for sid, tickets in self._queues[priority].items():
+                    if sid == session_id and tickets:
+                        return {"position": position + 1, "waited": now - tickets[0].enqueued_at}
+                    position += len(tickets)
+            return None
+
+    def last_wait(self, session_id: str) -> float:
+        with self._lock:
+            return self._last_wait.get(session_id, 0.0)
+
+
+def request_info(config) -> tuple[str, str]:
+    """(session_id, priority) for a LangGraph RunnableConfig."""
+    configurable = (config or {}).get("configurable", {})
+    return configurable.get("thread_id", "default"), configurable.get("priority", "interactive")
+
+
+scheduler = LLMScheduler(
+    max_concurrency=int(os.environ.get("LLM_MAX_CONCURRENCY", "8")),
+    tokens_per_minute=int(os.environ.get("LLM_TOKENS_PER_MINUTE", "0")),
+    max_queue=int(os.environ.get("LLM_MAX_QUEUE", "200")),
+)
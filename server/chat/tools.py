@@ -1,39 +1,133 @@
 # chat/tools.py
 
-from langchain_core.tools import tool
-from chat.code_ass_graph import code_ass_help
-from langchain_experimental.utilities import PythonREPL
-from langchain_community.tools.tavily_search import TavilySearchResults
-from sandbox.start_sandbox import run_container
-
-
-tavily_search_tool = TavilySearchResults(max_results=1)
-
-@tool
-def python_repl(code: str) -> str:
-    """Executes small Python code snippets and returns the result. 
-    Useful for math, string manipulation, datetime parsing, or exploring logic.
-    """
-    repl = PythonREPL()
-    try:
-        result = repl.run(code)
-    except BaseException as e:
-        print (f"Failed to execute. Error: {repr(e)}")
-        # Rewrite the code and rerun it
-    return f"{result}"
-
-@tool
-def lcel_codegen(question: str) -> str:
-    """
-    Generates LangChain Expression Language (LCEL) code solutions.
-    Use this when the user requests LCEL-based chains, pipelines, or runnable examples.
-    """
-    result = code_ass_help(question)
+import asyncio
+from functools import cache
+from typing import Optional
+from pydantic import BaseModel, Field
+from langchain_core.tools import StructuredTool
+from langchain_core.runnables.config import RunnableConfig
+from chat import sandbox_client
+from chat.repl_pool import repl_pool
+from chat.scheduler import request_info
+
+# Tools are declared here with their schemas only. Heavy modules and clients
+# (Tavily, the code-gen workflow) are imported and built on first use, so that
+# importing chat.graph stays cheap.
+
+
+@cache
+def _tavily():
+    from langchain_community.tools.tavily_search import TavilySearchResults
+    return TavilySearchResults(max_results=1)
+
+class TavilyInput(BaseModel):
+    query: str = Field(description="search query to look up")
+
+def _tavily_search(query: str):
+    return _tavily().invoke({"query": query})
+
+async def _atavily_search(query: str):
+    return await _tavily().ainvoke({"query": query})
+
+tavily_search_tool = StructuredTool.from_function(
+    func=_tavily_search,
+    coroutine=_atavily_search,
+    name="tavily_search_results_json",
+    description=(
+        "A search engine optimized for comprehensive, accurate, and trusted results. "
+        "Useful for when you need to answer questions about current events. "
+        "Input should be a search query."
+    ),
+    args_schema=TavilyInput,
+)
+
+def _thread_id(config: RunnableConfig) -> str:
+    return config.get("configurable", {}).get("thread_id", "default")
+
+class PythonReplInput(BaseModel):
+    code: str = Field(default="", description="Python code to run")
+    cells: Optional[list[str]] = Field(
+        default=None,
+        description="Several dependent snippets to run in order in one call, instead of `code`",
+    )
+    stop_on_error: bool = Field(default=True, description="With `cells`, skip the rest after a failing cell")
+
+def _format_cells(results: list[tuple[str, str]]) -> str:
+    return "\n".join(f"[cell {i}: {status}]\n{output}" for i, (status, output) in enumerate(results, 1))
+
+def _python_repl(config: RunnableConfig, code: str = "", cells: Optional[list[str]] = None,
+                 stop_on_error: bool = True) -> str:
+    # With a sandbox configured (SANDBOX_URL or a pool), code runs in the user's Jupyter kernel;
+    # otherwise in the local per-thread worker pool
+    if sandbox_client.enabled():
+        if cells:
+            return _format_cells(sandbox_client.run_cells(_thread_id(config), cells, stop_on_error))
+        return sandbox_client.run_code(_thread_id(config), code)
+    if cells:
+        return _format_cells(repl_pool.run_batch(_thread_id(config), cells, stop_on_error))
+    return repl_pool.run(_thread_id(config), code)
+
+async def _apython_repl(config: RunnableConfig, code: str = "", cells: Optional[list[str]] = None,
+                        stop_on_error: bool = True) -> str:
+    # Runs in a worker process or the sandbox; awaiting it never blocks the event loop
+    if sandbox_client.enabled():
+        if cells:
+            return _format_cells(await asyncio.to_thread(
+                sandbox_client.run_cells, _thread_id(config), cells, stop_on_error
+            ))
+        return await asyncio.to_thread(sandbox_client.run_code, _thread_id(config), code)
+    if cells:
+        return _format_cells(await repl_pool.arun_batch(_thread_id(config), cells, stop_on_error))
+    return await repl_pool.arun(_thread_id(config), code)
+
+python_repl = StructuredTool.from_function(
+    func=_python_repl,
+    coroutine=_apython_repl,
+    name="python_repl",
+    description=(
+        "Executes small Python code snippets and returns the printed output. "
+        "Variables persist between calls in the same conversation. "
+        "Useful for math, string manipulation, datetime parsing, or exploring logic. "
+        "For several dependent steps (load, transform, describe), pass them as `cells` "
+        "in one call rather than calling the tool once per step."
+    ),
+    args_schema=PythonReplInput,
+)
+
+class LcelCodegenInput(BaseModel):
+    question: str = Field(description="what the LCEL code should do")
+
+def _format_solution(result) -> str:
     if not result:
         return "Failed to generate code. Try rephrasing your question."
-    
     return (
         f"{result.prefix}\n\n"
         f"**IMPORTS:**\n```python\n{result.imports}\n```\n\n"
         f"**CODE:**\n```python\n{result.code}\n```\n"
     )
+
+def _lcel_codegen(question: str, config: RunnableConfig) -> str:
+    from chat.code_ass_graph import code_ass_help
+
+    # Sub-calls inherit the turn's priority, so code-gen never queues behind
+    # other sessions' background work while the user waits on it
+    session_id, priority = request_info(config)
+    return _format_solution(code_ass_help(question, session_id=session_id, priority=priority))
+
+async def _alcel_codegen(question: str, config: RunnableConfig) -> str:
+    from chat.code_ass_graph import acode_ass_help
+
+    # Awaited on the turn's task, so Stop cancels the generate/retry LLM calls
+    session_id, priority = request_info(config)
+    return _format_solution(await acode_ass_help(question, session_id=session_id, priority=priority))
+
+lcel_codegen = StructuredTool.from_function(
+    func=_lcel_codegen,
+    coroutine=_alcel_codegen,
+    name="lcel_codegen",
+    description=(
+        "Generates LangChain Expression Language (LCEL) code solutions. "
+        "Use this when the user requests LCEL-based chains, pipelines, or runnable examples."
+    ),
+    args_schema=LcelCodegenInput,
+)
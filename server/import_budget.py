@@ -0,0 +1,33 @@
+# import_budget.py
+#
+# Cold-start guard: imports the server (or another module) in a fresh
+# interpreter and fails if it takes longer than the budget.
+#
+#   python import_budget.py                 # server, default budget
+#   python import_budget.py chat.graph 1.0  # module, budget in seconds
+
+import os
+import subprocess
+import sys
+import time
+
+DEFAULT_BUDGET = float(os.environ.get("IMPORT_BUDGET_S", "2.0"))
+
+
+def measure(module: str, runs: int = 3) -> float:
+    """Best wall time over `runs` fresh imports, so a cold disk cache doesn't count."""
+    best = float("inf")
+    here = os.path.dirname(os.path.abspath(__file__))
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, "-c", f"import {module}"], cwd=here, check=True)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+if __name__ == "__main__":
+    module = sys.argv[1] if len(sys.argv) > 1 else "server"
+    budget = float(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_BUDGET
+    elapsed = measure(module)
+    print(f"import {module}: {elapsed:.2f}s (budget {budget:.2f}s)")
+    sys.exit(0 if elapsed <= budget else 1)
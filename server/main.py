@@ -3,11 +3,16 @@
 import sys
 import os
 import ast
+import json
+import time
+import asyncio
+import argparse
 
 from chat.graph import init_graph
 from chat.modes import modes
-from langchain_core.messages import HumanMessage
+from langchain_core.messages import HumanMessage, ToolMessage
 from langgraph.graph.state import CompiledStateGraph
+from langgraph.checkpoint.memory import MemorySaver
 from langchain_core.runnables.config import RunnableConfig
 
 # Terminal color codes
@@ -17,55 +22,41 @@ USER_PROMPT_COLOR = "\033[0;32m"
 USER_COLOR = "\033[1;4;32m"
 RESET_COLOR = "\033[0m"
 
+def render_chunk(message, metadata: dict) -> str:
+    """Text to show for one (message, metadata) pair from stream_mode="messages".
+    Tool results are recognised by the node that produced them, not by scanning the text."""
+    if metadata.get("langgraph_node") == "tools":
+        return _render_tool(message)
+    content = getattr(message, "content", "")
+    return content if isinstance(content, str) else ""
+
+def _render_tool(message) -> str:
+    if getattr(message, "name", "") != "tavily_search_results_json":
+        return ""
+    return _neatify(message.content)
+
 def stream_graph_updates(graph: CompiledStateGraph, tid: str, user_input: str):
     config: RunnableConfig = {"configurable": {"thread_id": tid}}
-    tool_block_accumulator = ""
 
     print(f"\n🤖 {AI_COLOR} AI Chat Bot{"\033[1;34m"}{AI_PROMPT_COLOR}:")
 
-    for chunk in graph.stream(
+    for message_obj, metadata in graph.stream(
         {"messages": [HumanMessage(content=user_input)]},
         config,
         stream_mode="messages"
     ):
-        message_obj, metadata = chunk[0], chunk[1]
-        text = getattr(message_obj, "content", "")
-
-        if not text:
-            continue
-
-        combined_text = tool_block_accumulator + text
-        tool_block_accumulator = ""
-        output_buffer = ""
-        remaining = combined_text
-
-        while True:
-            start_index = remaining.find("[{")
-            if start_index == -1:
-                output_buffer += remaining
-                break
-
-            output_buffer += remaining[:start_index]
-            end_index = remaining.find("}]", start_index)
-
-            if end_index == -1:
-                tool_block_accumulator = remaining[start_index:]
-                break
-
-            bracketed_str = remaining[start_index:end_index + 2]
-            remaining = remaining[end_index + 2:]
-            neat_str = _neatify(bracketed_str)
-            output_buffer += neat_str
-
-        if output_buffer.strip():
-            print(f"{AI_PROMPT_COLOR}" + output_buffer, end="", flush=True)
+        if text := render_chunk(message_obj, metadata):
+            print(f"{AI_PROMPT_COLOR}" + text, end="", flush=True)
     print("\n")
 
-def _neatify(bracketed_str: str) -> str:
+def _neatify(tool_output: str) -> str:
     try:
-        data = ast.literal_eval(bracketed_str)
-    except Exception as e:
-        return ""
+        data = json.loads(tool_output)
+    except ValueError:
+        try:
+            data = ast.literal_eval(tool_output)
+        except Exception as e:
+            return ""
 
     lines = []
     if isinstance(data, list):
@@ -77,19 +68,109 @@ def _neatify(bracketed_str: str) -> str:
             lines.append(f"• **{title}**\n  URL: {url}\n  snippet: {snippet}\n")
     return "\n".join(lines)
 
+# -----------------------
+# Batch mode
+# -----------------------
+async def run_batch_item(graph: CompiledStateGraph, index: int, line: str, default_mode: str) -> dict:
+    """Run one JSONL line's prompt on its own thread and collect output, tool calls and timing."""
+    # The thread comes from the line number, so items with the same "id" never share history
+    config: RunnableConfig = {"configurable": {"thread_id": f"batch-{index}"}}
+    item_id, prompt = index, None
+
+    started = time.perf_counter()
+    first_token = None
+    output, tools = [], []
+    input_tokens = output_tokens = 0
+    error = None
+    try:
+        # A malformed line fails its own item, not the whole batch
+        item = json.loads(line)
+        if not isinstance(item, dict):
+            raise ValueError("line is not a JSON object")
+        item_id, prompt = item.get("id", index), item.get("prompt")
+        if not isinstance(prompt, str) or not prompt.strip():
+            raise ValueError('item needs a non-empty "prompt" string')
+        await graph.aupdate_state(config, {"mode": item.get("mode", default_mode)}, as_node="chatbot")
+        async for message_obj, metadata in graph.astream(
+            {"messages": [HumanMessage(content=prompt)]},
+            config,
+            stream_mode="messages"
+        ):
+            # Nested model chunks from inside a tool also stream under "tools"
+            if isinstance(message_obj, ToolMessage):
+                tools.append(message_obj.name)
+            if usage := getattr(message_obj, "usage_metadata", None):
+                input_tokens += usage.get("input_tokens", 0)
+                output_tokens += usage.get("output_tokens", 0)
+            if text := render_chunk(message_obj, metadata):
+                if first_token is None:
+                    first_token = time.perf_counter() - started
+                output.append(text)
+    except Exception as e:
+        error = repr(e)
+
+    return {
+        "id": item_id,
+        "prompt": prompt,
+        "output": "".join(output),
+        "tools": tools,
+        "error": error,
+        "latency_s": round(time.perf_counter() - started, 3),
+        "first_token_s": round(first_token, 3) if first_token is not None else None,
+        "input_tokens": input_tokens,
+        "output_tokens": output_tokens,
+    }
+
+async def run_batch(in_path: str, out_path: str, concurrency: int, mode_key: str):
+    """
+    Run every prompt in a JSONL file ({"prompt": ..., optional "id" and "mode"})
+    as an independent thread, at most `concurrency` at a time, and write one
+    result line per prompt to out_path as it completes.
+    """
+    with open(in_path, encoding="utf-8") as f:
+        lines = [line for line in f if line.strip()]
+
+    graph = init_graph("batch", MemorySaver())
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def bounded(index, line):
+        async with semaphore:
+            return await run_batch_item(graph, index, line, mode_key)
+
+    started = time.perf_counter()
+    failed = 0
+    with open(out_path, "w", encoding="utf-8") as out:
+        for result in asyncio.as_completed([bounded(i, line) for i, line in enumerate(lines)]):
+            result = await result
+            failed += result["error"] is not None
+            out.write(json.dumps(result, ensure_ascii=False) + "\n")
+            out.flush()
+            print(f"[{result['id']}] {result['latency_s']}s {'ERROR' if result['error'] else 'ok'}")
+
+    print(f"{len(lines)} prompts, {failed} failed, {time.perf_counter() - started:.1f}s total -> {out_path}")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="LangGraph CLI chat")
+    parser.add_argument("mode", nargs="?", default="default", help="chat mode key")
+    parser.add_argument("--batch", metavar="PROMPTS_JSONL", help="run prompts from a JSONL file instead of chatting")
+    parser.add_argument("--out", default="batch_results.jsonl", help="where to write batch results")
+    parser.add_argument("--concurrency", type=int, default=4, help="max prompts in flight in batch mode")
+    return parser.parse_args()
+
 def cli_chat():
-    if len(sys.argv) >= 2:
-        mode_key = sys.argv[1]
-        if mode_key not in modes:
-            print(f"Invalid mode key: {mode_key}")
-            print(f"Available keys: {list(modes.keys())}")
-            sys.exit(1)
-    else:
-        mode_key = "default"
-
-    mode_prompt = modes.get(mode_key, None) or "default"
+    args = parse_args()
+    mode_key = args.mode
+    if mode_key not in modes:
+        print(f"Invalid mode key: {mode_key}")
+        print(f"Available keys: {list(modes.keys())}")
+        sys.exit(1)
+
+    if args.batch:
+        asyncio.run(run_batch(args.batch, args.out, args.concurrency, mode_key))
+        return
+
     tid = "cli-thread"
-    graph = init_graph(tid, sys_msg=None, human_msg=mode_prompt)
+    graph = init_graph(tid, MemorySaver(), mode=mode_key)
 
     print(f"{RESET_COLOR}\n🧠 LangGraph CLI Chat — Mode: {mode_key}\n(Press Ctrl+C or type 'quit' to exit)\n")
 
@@ -0,0 +1,258 @@
+# sandbox/pool.py
+
+import bisect
+import hashlib
+import os
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+import urllib.request
+from typing import Dict, List, Optional
+
+
+SANDBOX_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    """Consistent hash ring with virtual nodes, so adding or removing one
+    instance only moves ~1/N of the users."""
+
+    def __init__(self, nodes: Optional[List[str]] = None, replicas: int = 64):
+        self.replicas = replicas
+        self._keys: List[int] = []
+        self._owners: Dict[int, str] = {}
+        for node in nodes or []:
+            self.add(node)
+
+    def add(self, node: str):
+        for i in range(self.replicas):
+            h = _hash(f"{node}#{i}")
+            bisect.insort(self._keys, h)
+            self._owners[h] = node
+
+    def remove(self, node: str):
+        for i in range(self.replicas):
+            h = _hash(f"{node}#{i}")
+            self._keys.remove(h)
+            del self._owners[h]
+
+    def get(self, key: str) -> str:
+        if not self._keys:
+            raise RuntimeError("Sandbox pool is empty")
+        idx = bisect.bisect(self._keys, _hash(key)) % len(self._keys)
+        return self._owners[self._keys[idx]]
+
+
+class SandboxInstance:
+    def __init__(self, name: str, port: int, handle=None):
+        self.name = name
+        self.port = port
+        self.handle = handle  # Container or Popen, owned by the backend
+        self.failures = 0
+
+    @property
+    def url(self) -> str:
+        return f"http://localhost:{self.port}"
+
+
+class DockerBackend:
+    """Runs each instance as its own sandbox container (see start_sandbox)."""
+
+    def __init__(self, image: str = "sandbox"):
+        self.image = image
+
+    def start(self, name: str, port: int) -> SandboxInstance:
+        from sandbox.start_sandbox import run_container
+
+        # Spark UI ports are left to Docker so instances don't collide
+        container = run_container(
+            image=self.image,
+            name=name,
+            ports={"5002/tcp": port, "4040/tcp": None, "4041/tcp": None},
+        )
+        return SandboxInstance(name, port, container)
+
+    def stop(self, instance: SandboxInstance):
+        try:
+            instance.handle.remove(force=True)
+        except Exception as e:
+            print(f"Error removing container {instance.name}: {e}")
+
+
+class LocalProcessBackend:
+    """Runs each instance as a plain uvicorn process, for testing without Docker."""
+
+    def __init__(self, sessions_dir: Optional[str] = None):
+        self.sessions_dir = sessions_dir
+
+    def start(self, name: str, port: int) -> SandboxInstance:
+        env = dict(os.environ)
+        if self.sessions_dir:
+            env["JUPYTER_SESSIONS_DIR"] = self.sessions_dir
+        proc = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "sandbox:app",
+             "--host", "127.0.0.1", "--port", str(port)],
+            cwd=SANDBOX_DIR,
+            env=env,
+        )
+        return SandboxInstance(name, port, proc)
+
+    def stop(self, instance: SandboxInstance):
+        instance.handle.terminate()
+        try:
+            instance.handle.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            instance.handle.kill()
+
+
+class SandboxPool:
+    """
+    Manages N sandbox instances and routes each user_id to one of them by
+    consistent hashing. A background thread health-checks the instances and
+    replaces those that fail `max_failures` checks in a row.
+    """
+
+    def __init__(self, backend, size: int = 2, base_port: int = 5002,
+                 name_prefix: str = "py-sandbox", health_interval: float = 10.0,
+                 max_failures: int = 3):
+        self.backend = backend
+        self.base_port = base_port
+        self.name_prefix = name_prefix
+        self.health_interval = health_interval
+        self.max_failures = max_failures
+
+        self.instances: Dict[str, SandboxInstance] = {}
+        self.ring = HashRing()
+        self.assignments: Dict[str, str] = {}  # user_id -> instance name
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self._health_thread: Optional[threading.Thread] = None
+        self._target_size = size
+
+    # ---- lifecycle ----
+    def start(self):
+        self.resize(self._target_size)
+        self._health_thread = threading.Thread(target=self._health_loop, daemon=True)
+        self._health_thread.start()
+
+    def shutdown(self):
+        self._stop.set()
+        with self._lock:
+            for instance in list(self.instances.values()):
+                self.backend.stop(instance)
+            self.instances.clear()
+            self.ring = HashRing()
+            self.assignments.clear()
+
+    def _slot_name(self, slot: int) -> str:
+        return f"{self.name_prefix}-{slot}"
+
+    def resize(self, size: int) -> List[str]:
+        """Grow or shrink the pool. Returns user_ids that moved to another instance;
+        their sessions on the old instance are ended so they restart on the new one."""
+        with self._lock:
+            self._target_size = size
+            wanted = {self._slot_name(i): self.base_port + i for i in range(size)}
+
+            for name in list(self.instances):
+                if name not in wanted:
+                    self.ring.remove(name)
+                    self.backend.stop(self.instances.pop(name))
+            for name, port in wanted.items():
+                if name not in self.instances:
+                    self.instances[name] = self.backend.start(name, port)
+                    self.ring.add(name)
+
+            return self._rebalance()
+
+    def _rebalance(self) -> List[str]:
+        moved = []
+        for user_id, old in list(self.assignments.items()):
+            new = self.ring.get(user_id)
+            if new == old:
+                continue
+            moved.append(user_id)
+            self.assignments[user_id] = new
+            if old in self.instances:
+                self._end_session(self.instances[old], user_id)
+        return moved
+
+    # ---- routing ----
+    def route(self, user_id: str) -> str:
+        """Base URL of the sandbox instance that owns user_id."""
+        with self._lock:
+            name = self.ring.get(user_id)
+            self.assignments[user_id] = name
+            return self.instances[name].url
+
+    # ---- health ----
+    def _healthy(self, instance: SandboxInstance) -> bool:
+        try:
+            with urllib.request.urlopen(f"{instance.url}/hello_world", timeout=2) as resp:
+                return resp.status == 200
+        except Exception:
+            return False
+
+    def check_health(self):
+        with self._lock:
+            instances = list(self.instances.values())
+        for instance in instances:
+            if self._healthy(instance):
+                instance.failures = 0
+                continue
+            instance.failures += 1
+            if instance.failures >= self.max_failures:
+                self._replace(instance)
+
+    def _replace(self, instance: SandboxInstance):
+        with self._lock:
+            # check_health runs outside the lock, so the instance may have been
+            # removed by resize() or already replaced since it was checked
+            if self.instances.get(instance.name) is not instance:
+                return
+            print(f"Sandbox {instance.name} failed health checks, replacing it.")
+            self.backend.stop(instance)
+            # Same name and port, so routing is unchanged; kernel state is lost
+            self.instances[instance.name] = self.backend.start(instance.name, instance.port)
+
+    def _health_loop(self):
+        while not self._stop.wait(self.health_interval):
+            try:
+                self.check_health()
+            except Exception as e:
+                print(f"Sandbox health check error: {e}")
+
+    def _end_session(self, instance: SandboxInstance, user_id: str):
+        data = f"user_id={urllib.parse.quote(user_id)}".encode()
+        try:
+            urllib.request.urlopen(f"{instance.url}/end_session", data=data, timeout=5).close()
+        except Exception:
+            pass  # No session there, or instance already gone
+
+
+def wait_until_ready(pool: SandboxPool, timeout: float = 60.0):
+    """Block until every instance answers its health check."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if all(pool._healthy(i) for i in list(pool.instances.values())):
+            return
+        time.sleep(0.5)
+    raise TimeoutError("Sandbox pool failed to start within timeout period")
+
+
+if __name__ == "__main__":
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else os.cpu_count() or 2
+    pool = SandboxPool(DockerBackend(), size=size)
+    pool.start()
+    print(f"Started {size} sandbox instances:", [i.url for i in pool.instances.values()])
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pool.shutdown()
@@ -1,5 +1,5 @@
 from fastapi import FastAPI, UploadFile, Form, HTTPException
-import subprocess
+import re
 from pydantic import BaseModel
 import os
 import queue
@@ -8,14 +8,114 @@ from jupyter_client import KernelManager
 import nbformat
 from nbformat.v4 import new_notebook, new_code_cell
 import time
-from typing import Dict, Optional
+import json
+import shutil
+from collections import defaultdict
+from typing import Dict, List, Optional
 
 # FastAPI instance
 app = FastAPI()
 
 # Base folders
 BASE_FOLDER = "/mnt/data"
-SESSIONS_FOLDER = "/mnt/jupyter_sessions"
+SESSIONS_FOLDER = os.environ.get("JUPYTER_SESSIONS_DIR", "/mnt/jupyter_sessions")
+
+# Opt-in: serialize the user namespace when a kernel is evicted or reset,
+# and restore it lazily on the session's next /execute
+SNAPSHOT_ON_EVICT = os.environ.get("SANDBOX_SNAPSHOT_ON_EVICT", "0").lower() in ("1", "true", "yes")
+
+# pip cache and install index live in the mounted python_env (~/.local),
+# so they survive container restarts and are shared across sessions
+PYTHON_ENV_DIR = os.path.expanduser("~/.local")
+PIP_CACHE_DIR = os.environ.get("PIP_CACHE_DIR", os.path.join(PYTHON_ENV_DIR, "pip-cache"))
+INSTALL_INDEX_PATH = os.path.join(PYTHON_ENV_DIR, "installed_specs.json")
+INSTALL_TIMEOUT = 300  # 5 minute timeout
+MAX_BATCH_CELLS = 50
+
+SETUP_CODE = """
+import pandas as pd
+import numpy as np
+import matplotlib.pyplot as plt
+"""
+
+# Runs inside the kernel. DataFrames go to Parquet (Arrow), everything else
+# through cloudpickle (falls back to pickle). Modules are recorded by name so
+# aliases like `pd` come back as imports rather than pickled objects.
+_SNAPSHOT_CODE = """
+def __sandbox_snapshot(path):
+    import os, json, types, pickle
+    try:
+        import cloudpickle as _pickler
+    except ImportError:
+        _pickler = pickle
+    try:
+        import pandas as _pd
+    except ImportError:
+        _pd = None
+    skip = {"In", "Out", "exit", "quit", "get_ipython"}
+    os.makedirs(path, exist_ok=True)
+    manifest = {"modules": {}, "frames": [], "objects": [], "skipped": []}
+    for name, value in list(globals().items()):
+        if name.startswith("_") or name in skip:
+            continue
+        if isinstance(value, types.ModuleType):
+            manifest["modules"][name] = value.__name__
+            continue
+        if _pd is not None and isinstance(value, _pd.DataFrame):
+            # Parquet rejects e.g. mixed-type object columns or non-string
+            # column names; those frames go through the pickler below
+            frame_path = os.path.join(path, name + ".parquet")
+            try:
+                value.to_parquet(frame_path)
+                manifest["frames"].append(name)
+                continue
+            except Exception:
+                if os.path.exists(frame_path):
+                    os.remove(frame_path)
+        try:
+            with open(os.path.join(path, name + ".pkl"), "wb") as f:
+                _pickler.dump(value, f)
+            manifest["objects"].append(name)
+        except Exception:
+            manifest["skipped"].append(name)
+    with open(os.path.join(path, "manifest.json"), "w") as f:
+        json.dump(manifest, f)
+    return manifest
+
+print(__import__("json").dumps(__sandbox_snapshot(__PATH__)))
+del __sandbox_snapshot
+"""
+
+_RESTORE_CODE = """
+def __sandbox_restore(path):
+    import os, json, pickle, importlib
+    with open(os.path.join(path, "manifest.json")) as f:
+        manifest = json.load(f)
+    restored, failed = [], []
+    for name, module in manifest["modules"].items():
+        try:
+            globals()[name] = importlib.import_module(module)
+        except Exception:
+            failed.append(name)
+    for name in manifest["frames"]:
+        try:
+            import pandas as _pd
+            globals()[name] = _pd.read_parquet(os.path.join(path, name + ".parquet"))
+            restored.append(name)
+        except Exception:
+            failed.append(name)
+    for name in manifest["objects"]:
+        try:
+            with open(os.path.join(path, name + ".pkl"), "rb") as f:
+                globals()[name] = pickle.load(f)
+            restored.append(name)
+        except Exception:
+            failed.append(name)
+    return {"restored": restored, "failed": failed, "skipped": manifest["skipped"]}
+
+print(__import__("json").dumps(__sandbox_restore(__PATH__)))
+del __sandbox_restore
+"""
 
 class JupyterController:
     def __init__(self, folder_path):
@@ -84,7 +184,7 @@ class JupyterController:
             except queue.Empty:
                 break
 
-    async def execute_code(self, code):
+    async def execute_code(self, code, timeout=10):
         """Execute code with proper error handling and state checks"""
         if not self._kernel_ready:
             raise RuntimeError("Kernel not ready. Please wait for initialization or restart session.")
@@ -102,7 +202,10 @@ class JupyterController:
 
         while True:
             try:
-                msg = self.kernel_client.get_iopub_msg(timeout=10)
+                # Waited on in a thread so the event loop stays free, e.g. for /interrupt
+                msg = await asyncio.to_thread(self.kernel_client.get_iopub_msg, timeout=timeout)
+                if msg['parent_header'].get('msg_id') != msg_id:
+                    continue  # Late output or status from an earlier request
                 msg_type = msg['header']['msg_type']
                 content = msg['content']
 
@@ -134,6 +237,82 @@ class JupyterController:
         # If no output was captured but code executed successfully, return empty string
         return '\n'.join(outputs) if outputs else ""
 
+    async def execute_cells(self, cells, stop_on_error=True, cell_timeout=10):
+        """
+        Submit every cell at once so the kernel runs them back to back, then
+        sort iopub messages into per-cell results by parent msg_id. A cell that
+        runs past `cell_timeout` is interrupted. With stop_on_error the kernel
+        aborts the queued cells after the first failure and they are reported
+        as skipped.
+        """
+        if not self._kernel_ready:
+            raise RuntimeError("Kernel not ready. Please wait for initialization or restart session.")
+
+        if not self.kernel_manager.is_alive():
+            self._kernel_ready = False
+            raise RuntimeError("Kernel died. Please restart session.")
+
+        self._clear_output_queue()
+
+        msg_ids = [self.kernel_client.execute(code, stop_on_error=stop_on_error) for code in cells]
+        cell_index = {msg_id: i for i, msg_id in enumerate(msg_ids)}
+        results = [{"status": "pending", "output": []} for _ in cells]
+        current = 0
+        # The clock for a cell starts when the previous one finishes
+        deadline = time.monotonic() + cell_timeout
+
+        while current < len(cells):
+            try:
+                msg = await asyncio.to_thread(
+                    self.kernel_client.get_iopub_msg, timeout=max(deadline - time.monotonic(), 0.01)
+                )
+            except queue.Empty:
+                if results[current]["status"] == "timeout":
+                    # Did not even stop after the interrupt; give up on the rest
+                    break
+                results[current]["status"] = "timeout"
+                self.interrupt_kernel()
+                deadline = time.monotonic() + 5
+                continue
+
+            i = cell_index.get(msg['parent_header'].get('msg_id'))
+            if i is None:
+                continue
+            msg_type = msg['header']['msg_type']
+            content = msg['content']
+            result = results[i]
+
+            if msg_type == 'stream':
+                result["output"].append(content['text'])
+            elif msg_type == 'execute_result':
+                result["output"].append(str(content['data'].get('text/plain', '')))
+            elif msg_type == 'display_data':
+                text_data = content['data'].get('text/plain', '')
+                if text_data:
+                    result["output"].append(str(text_data))
+            elif msg_type == 'error':
+                if result["status"] != "timeout":
+                    result["status"] = "error"
+                result["traceback"] = content['traceback']
+            elif msg_type == 'status' and content['execution_state'] == 'idle' and i >= current:
+                if result["status"] == "pending":
+                    result["status"] = "ok"
+                current = i + 1
+                deadline = time.monotonic() + cell_timeout
+                if stop_on_error and result["status"] != "ok":
+                    break
+
+        for result in results:
+            if result["status"] == "pending":
+                result["status"] = "skipped"
+            result["output"] = '\n'.join(result["output"])
+        return results
+
+    def interrupt_kernel(self):
+        """Send SIGINT to the kernel; a running cell ends with KeyboardInterrupt"""
+        if self.kernel_manager and self.kernel_manager.is_alive():
+            self.kernel_manager.interrupt_kernel()
+
     async def reset_kernel(self):
         """Reset kernel with proper state management"""
         if self.kernel_manager:
@@ -142,6 +321,19 @@ class JupyterController:
             await self._wait_for_kernel_ready()
             self._clear_output_queue()
 
+    async def snapshot_namespace(self, path):
+        """Serialize the picklable user namespace to `path`, returns the manifest"""
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        output = await self.execute_code(_SNAPSHOT_CODE.replace("__PATH__", repr(path)), timeout=120)
+        return json.loads(output.strip().splitlines()[-1])
+
+    async def restore_namespace(self, path):
+        """Load a namespace written by snapshot_namespace back into the kernel"""
+        output = await self.execute_code(_RESTORE_CODE.replace("__PATH__", repr(path)), timeout=120)
+        shutil.rmtree(path, ignore_errors=True)
+        return json.loads(output.strip().splitlines()[-1])
+
     def cleanup(self):
         """Proper cleanup of resources"""
         if self.kernel_client:
@@ -157,18 +349,53 @@ class SessionInfo:
         self.controller = controller
         self.created_at = created_at
         self.last_activity = created_at
+        self.pending_restore = False
 
 sessions: Dict[str, SessionInfo] = {}
 
+# Serializes creating and restoring a user's kernel, so concurrent requests
+# for an evicted session bring back one kernel rather than one each
+session_locks: Dict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+
 # Models
 class ExecuteRequest(BaseModel):
     user_id: str
     code: str
 
+class ExecuteBatchRequest(BaseModel):
+    user_id: str
+    cells: List[str]
+    stop_on_error: bool = True
+    cell_timeout: float = 10
+
 class InstallPackageRequest(BaseModel):
     user_id: str
     package_name: str
 
+def snapshot_path(user_id: str) -> str:
+    return os.path.join(SESSIONS_FOLDER, user_id, "snapshot")
+
+def has_snapshot(user_id: str) -> bool:
+    return os.path.exists(os.path.join(snapshot_path(user_id), "manifest.json"))
+
+async def evict_session(user_id: str):
+    """Shut down a session's kernel, snapshotting its namespace first if enabled"""
+    # Held while the snapshot is written, so a request arriving meanwhile
+    # restores the finished snapshot instead of a partial one
+    async with session_locks[user_id]:
+        session_info = sessions.pop(user_id, None)
+        if session_info is None:
+            # Already ended or evicted by a concurrent request
+            return
+        if SNAPSHOT_ON_EVICT and session_info.controller._kernel_ready:
+            try:
+                manifest = await session_info.controller.snapshot_namespace(snapshot_path(user_id))
+                print(f"Snapshot for {user_id}: {len(manifest['frames'])} frames, "
+                      f"{len(manifest['objects'])} objects, skipped {manifest['skipped']}")
+            except Exception as e:
+                print(f"Snapshot failed for {user_id}: {e}")
+        session_info.controller.cleanup()
+
 # Session cleanup task
 async def cleanup_inactive_sessions():
     while True:
@@ -181,8 +408,7 @@ async def cleanup_inactive_sessions():
                 to_remove.append(user_id)
         
         for user_id in to_remove:
-            session_info = sessions.pop(user_id)
-            session_info.controller.cleanup()
+            await evict_session(user_id)
             
         await asyncio.sleep(300)  # Check every 5 minutes
 
@@ -192,10 +418,34 @@ async def cleanup_inactive_sessions():
 async def startup_event():
     asyncio.create_task(cleanup_inactive_sessions())
 
+async def create_session(user_id: str) -> str:
+    """Start a fresh kernel for user_id and register it, returns the notebook path"""
+    session_folder = os.path.join(SESSIONS_FOLDER, user_id)
+    controller = JupyterController(session_folder)
+
+    try:
+        notebook_path = await controller.create_notebook(f"notebook_{user_id}")
+        sessions[user_id] = SessionInfo(controller, time.time())
+
+        # Initialize common imports that might be needed
+        await controller.execute_code(SETUP_CODE)
+        return notebook_path
+    except Exception:
+        controller.cleanup()
+        raise
+
 # Helper function to get and validate session
-async def get_session(user_id: str) -> SessionInfo:
+async def get_session(user_id: str, restore: bool = False) -> SessionInfo:
+    async with session_locks[user_id]:
+        return await _get_session(user_id, restore)
+
+async def _get_session(user_id: str, restore: bool) -> SessionInfo:
     if user_id not in sessions:
-        raise HTTPException(status_code=404, detail="Session not found. Please start a new session.")
+        if not (restore and has_snapshot(user_id)):
+            raise HTTPException(status_code=404, detail="Session not found. Please start a new session.")
+        # Evicted session: bring the kernel back and restore on this call
+        await create_session(user_id)
+        sessions[user_id].pending_restore = True
     
     session_info = sessions[user_id]
     session_info.last_activity = time.time()
@@ -206,7 +456,12 @@ async def get_session(user_id: str) -> SessionInfo:
         except TimeoutError:
             # If kernel is not responding, try to reset it
             await session_info.controller.reset_kernel()
-    
+
+    if restore and session_info.pending_restore:
+        session_info.pending_restore = False
+        result = await session_info.controller.restore_namespace(snapshot_path(user_id))
+        print(f"Restored namespace for {user_id}: {result}")
+
     return session_info
 
 # Routes
@@ -217,36 +472,26 @@ async def hello_():
 
 @app.post("/start_session")
 async def start_session(user_id: str = Form(...)):
-    if user_id in sessions:
-        # Clean up existing session if it exists
-        sessions[user_id].controller.cleanup()
-    
-    session_folder = os.path.join(SESSIONS_FOLDER, user_id)
-    controller = JupyterController(session_folder)
-    
-    try:
-        notebook_path = await controller.create_notebook(f"notebook_{user_id}")
-        sessions[user_id] = SessionInfo(controller, time.time())
-        
-        # Initialize common imports that might be needed
-        setup_code = """
-        import pandas as pd
-        import numpy as np
-        import matplotlib.pyplot as plt
-        """
-        await controller.execute_code(setup_code)
-        
-        return {
-            "message": "Session started successfully",
-            "notebook_path": notebook_path
-        }
-    except Exception as e:
-        controller.cleanup()
-        raise HTTPException(status_code=500, detail=str(e))
+    async with session_locks[user_id]:
+        if user_id in sessions:
+            # Clean up existing session if it exists
+            sessions.pop(user_id).controller.cleanup()
+
+        # An explicit new session starts from a clean namespace
+        shutil.rmtree(snapshot_path(user_id), ignore_errors=True)
+
+        try:
+            notebook_path = await create_session(user_id)
+            return {
+                "message": "Session started successfully",
+                "notebook_path": notebook_path
+            }
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/execute")
 async def execute_code(request: ExecuteRequest):
-    session_info = await get_session(request.user_id)
+    session_info = await get_session(request.user_id, restore=True)
     
     try:
         output = await session_info.controller.execute_code(request.code)
@@ -256,40 +501,113 @@ async def execute_code(request: ExecuteRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/execute_batch")
+async def execute_batch(request: ExecuteBatchRequest):
+    if not request.cells or len(request.cells) > MAX_BATCH_CELLS:
+        raise HTTPException(status_code=400, detail=f"Send between 1 and {MAX_BATCH_CELLS} cells")
+    # One session lookup and one queue drain for the whole batch
+    session_info = await get_session(request.user_id, restore=True)
+
+    try:
+        results = await session_info.controller.execute_cells(
+            request.cells, stop_on_error=request.stop_on_error, cell_timeout=request.cell_timeout
+        )
+        return {"results": results}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+def _normalize_spec(spec: str) -> str:
+    return re.sub(r"\s+", "", spec).lower()
+
+def _load_install_index() -> Dict[str, float]:
+    try:
+        with open(INSTALL_INDEX_PATH) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def _save_install_index():
+    os.makedirs(os.path.dirname(INSTALL_INDEX_PATH), exist_ok=True)
+    tmp_path = INSTALL_INDEX_PATH + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(installed_specs, f)
+    os.replace(tmp_path, INSTALL_INDEX_PATH)
+
+installed_specs: Dict[str, float] = _load_install_index()
+install_tasks: Dict[str, asyncio.Task] = {}
+
+async def _pip_install(spec: str) -> str:
+    """Run pip as an async subprocess so the event loop keeps serving other sessions"""
+    proc = await asyncio.create_subprocess_exec(
+        "pip", "install", "--user", "--cache-dir", PIP_CACHE_DIR, spec,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    try:
+        stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout=INSTALL_TIMEOUT)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        raise HTTPException(
+            status_code=500,
+            detail=f"Package installation timed out for {spec}"
+        )
+
+    if proc.returncode != 0:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to install {spec}: {stderr.decode(errors='replace')}"
+        )
+
+    installed_specs[_normalize_spec(spec)] = time.time()
+    _save_install_index()
+    return stdout.decode(errors="replace")
+
+async def install_spec(spec: str) -> tuple[str, bool]:
+    """Install a package spec once. Concurrent callers for the same spec share one
+    pip run; specs already in the index return immediately. Returns (output, cached)."""
+    key = _normalize_spec(spec)
+    if key in installed_specs:
+        return "", True
+
+    task = install_tasks.get(key)
+    if task is None:
+        task = asyncio.create_task(_pip_install(spec))
+        install_tasks[key] = task
+        task.add_done_callback(lambda _: install_tasks.pop(key, None))
+    # shield: one caller disconnecting must not cancel the others' install
+    return await asyncio.shield(task), False
+
 @app.post("/install_package")
 async def install_package(request: InstallPackageRequest):
     session_info = await get_session(request.user_id)
     
     try:
-        # First try to install the package
-        result = subprocess.run(
-            # ["pip", "install", request.package_name],
-            ["pip", "install", "--no-cache-dir", "--user", request.package_name],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            timeout=300  # 5 minute timeout
-        )
-        
-        if result.returncode != 0:
-            raise HTTPException(
-                status_code=500,
-                detail=f"Failed to install {request.package_name}: {result.stderr}"
-            )
+        output, cached = await install_spec(request.package_name)
         
         # If installation successful, import in the kernel
-        import_code = f"import {request.package_name.split('[')[0]}"
-        await session_info.controller.execute_code(import_code)
+        module_name = re.split(r"[\[<>=!~;@ ]", request.package_name.strip())[0].replace("-", "_")
+        await session_info.controller.execute_code(f"import {module_name}")
         
         return {
             "message": f"Successfully installed and imported {request.package_name}",
-            "output": result.stdout
+            "output": "Already installed" if cached else output
         }
-    except subprocess.TimeoutExpired:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Package installation timed out for {request.package_name}"
-        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/interrupt")
+async def interrupt_session(user_id: str = Form(...)):
+    if user_id not in sessions:
+        raise HTTPException(status_code=404, detail="Session not found")
+
+    try:
+        sessions[user_id].controller.interrupt_kernel()
+        return {"message": "Kernel interrupted"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -298,15 +616,18 @@ async def reset_session(user_id: str = Form(...)):
     session_info = await get_session(user_id)
     
     try:
+        if SNAPSHOT_ON_EVICT:
+            # A failed snapshot must not block the reset the user asked for
+            try:
+                await session_info.controller.snapshot_namespace(snapshot_path(user_id))
+                session_info.pending_restore = True
+            except Exception as e:
+                print(f"Snapshot failed for {user_id}, resetting without it: {e}")
+
         await session_info.controller.reset_kernel()
         
         # Reinitialize common imports after reset
-        setup_code = """
-        import pandas as pd
-        import numpy as np
-        import matplotlib.pyplot as plt
-        """
-        await session_info.controller.execute_code(setup_code)
+        await session_info.controller.execute_code(SETUP_CODE)
         
         return {"message": "Kernel reset successful"}
     except Exception as e:
@@ -319,4 +640,5 @@ async def end_session(user_id: str = Form(...)):
     
     session_info = sessions.pop(user_id)
     session_info.controller.cleanup()
+    shutil.rmtree(snapshot_path(user_id), ignore_errors=True)
     return {"message": "Session ended successfully"}
\ No newline at end of file
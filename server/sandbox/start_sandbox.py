@@ -1,10 +1,20 @@
 import docker
 import os
+from functools import cache
 
-client = docker.from_env()
 
-def run_container(image="sandbox", name="py-sandbox"):
+@cache
+def docker_client():
+    # Connect on first use, not at import, so importing this module never
+    # needs a running Docker daemon
+    return docker.from_env()
+
+def run_container(image="sandbox", name="py-sandbox", ports=None):
+    """Start one sandbox container. `ports` maps container ports to host ports;
+    a host port of None lets Docker pick a free one."""
     pwd = os.getcwd()
+    if ports is None:
+        ports = {"5002/tcp": 5002, "4040/tcp": 4040, "4041/tcp": 4041}
 
     mounts = [
         docker.types.Mount(target="/mnt/data",
@@ -21,11 +31,11 @@ def run_container(image="sandbox", name="py-sandbox"):
                            read_only=False),
     ]
 
-    container = client.containers.run(
+    container = docker_client().containers.run(
         image=image,
         name=name,
         detach=True,
-        ports={"5002/tcp": 5002, "4040/tcp": 4040, "4041/tcp": 4041},
+        ports=ports,
         user="1000:1000",
         read_only=True,
         cap_drop=["ALL"],
@@ -34,6 +44,7 @@ def run_container(image="sandbox", name="py-sandbox"):
         mounts=mounts,
     )
     print("Started container:", container.short_id)
+    return container
 
 if __name__ == "__main__":
     run_container()
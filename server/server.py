@@ -5,15 +5,24 @@ from fastapi import UploadFile, File, FastAPI, WebSocket, WebSocketDisconnect, F
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 import os
+import uuid
 from typing import List
-from langchain_core.messages import HumanMessage, SystemMessage
+import aiosqlite
+from langchain_core.messages import HumanMessage
 from langchain_core.runnables.config import RunnableConfig
-from langgraph.checkpoint.memory import MemorySaver
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
 import time
 import shutil
 
-from chat.graph import init_graph
+from chat.graph import init_graph, close_open_tool_calls
 from chat.modes import modes
+from chat.scheduler import scheduler
+from chat.cancellation import cancellations
+from chat.prompt_cache import cache_stats
+from chat import sandbox_client
+from sandbox.pool import DockerBackend, SandboxPool, wait_until_ready
+from session_store import SqliteSessionStore
+from turn_log import TurnLog, TurnRegistry
 
 
 app = FastAPI()
@@ -25,19 +34,77 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-memory_store: dict = {}  # In-memory store of reusable memory per thread_id
 UPLOAD_DIR = "user_files"
+STATE_DIR = os.environ.get("SERVER_STATE_DIR", "state")
 
-try:
-    shutil.rmtree(UPLOAD_DIR)
-except FileNotFoundError:
-    pass
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
-loaded_files_set = set()
-file_map_backend = {}
-
-async def stream_response(graph, websocket, user_input, config):
+# Session state is shared through the store and the checkpoint DB rather than
+# module globals, so the server can run with several uvicorn workers
+session_store = SqliteSessionStore(os.path.join(STATE_DIR, "sessions.sqlite"))
+checkpointer: AsyncSqliteSaver | None = None
+
+SERVER_WORKERS = int(os.environ.get("SERVER_WORKERS", "1"))
+
+# With SANDBOX_POOL_SIZE set, python_repl runs in a pool of sandbox containers
+# owned by this process (so only with SERVER_WORKERS=1); each user is routed to
+# one instance by consistent hashing
+SANDBOX_POOL_SIZE = int(os.environ.get("SANDBOX_POOL_SIZE", "0"))
+sandbox_pool: SandboxPool | None = None
+
+@app.on_event("startup")
+async def startup_event():
+    global checkpointer, sandbox_pool
+    os.makedirs(STATE_DIR, exist_ok=True)
+    conn = await aiosqlite.connect(os.path.join(STATE_DIR, "checkpoints.sqlite"))
+    await conn.execute("PRAGMA journal_mode=WAL")
+    checkpointer = AsyncSqliteSaver(conn)
+    await checkpointer.setup()
+
+    if SANDBOX_POOL_SIZE > 0:
+        if SERVER_WORKERS > 1:
+            # Every worker would start its own containers on the same names and ports
+            raise RuntimeError("SANDBOX_POOL_SIZE needs SERVER_WORKERS=1; "
+                               "with several workers run the pool separately and set SANDBOX_URL")
+        sandbox_pool = SandboxPool(DockerBackend(), size=SANDBOX_POOL_SIZE)
+        await asyncio.to_thread(sandbox_pool.start)
+        await asyncio.to_thread(wait_until_ready, sandbox_pool)
+        sandbox_client.use_pool(sandbox_pool)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if checkpointer is not None:
+        await checkpointer.conn.close()
+    if sandbox_pool is not None:
+        sandbox_client.use_pool(None)
+        await asyncio.to_thread(sandbox_pool.shutdown)
+
+# Latest turn per session, for resuming after a dropped connection (see
+# turn_log.TurnRegistry for the multi-worker caveat)
+turns = TurnRegistry(grace=float(os.environ.get("TURN_GRACE_S", "120")))
+
+def session_upload_dir(session_id: str) -> str:
+    return os.path.join(UPLOAD_DIR, session_id)
+
+def valid_session_id(session_id: str) -> bool:
+    try:
+        uuid.UUID(session_id)
+        return True
+    except ValueError:
+        return False
+
+async def report_queue(log: TurnLog, session_id: str):
+    """While the session's model call waits in the scheduler, tell the client
+    its position and wait so far as [[QUEUE::position::seconds]]."""
+    while True:
+        await asyncio.sleep(0.5)
+        if status := scheduler.queue_status(session_id):
+            log.append(f"[[QUEUE::{status['position']}::{status['waited']:.1f}]]")
+
+async def stream_response(graph, log: TurnLog, user_input, config):
+    # Writes to the turn log rather than the socket, so generation is not tied
+    # to one connection and a reconnecting client can pick up where it left off
+    queue_task = asyncio.create_task(report_queue(log, config["configurable"]["thread_id"]))
     try:
         async for chunk in graph.astream(
             {"messages": [HumanMessage(content=user_input)]},
@@ -45,32 +112,126 @@ async def stream_response(graph, websocket, user_input, config):
             stream_mode="messages"
         ):
             if content := getattr(chunk[0], "content", ""):
-                await websocket.send_text(content)
+                log.append(content)
     except asyncio.CancelledError:
         print("Stream response task was cancelled.")
     except Exception as e:
-        await websocket.send_text(f"[ERROR] {str(e)}")
+        log.append(f"[ERROR] {str(e)}")
     finally:
-        await websocket.send_text("[[END]]")
+        queue_task.cancel()
+        log.append("[[END]]")
+        log.finish()
+
+async def forward_turn(log: TurnLog, websocket, offset: int = 0):
+    """Send a turn's chunks from `offset` on to one socket, following it live."""
+    try:
+        async for chunk in log.follow(offset):
+            await websocket.send_text(chunk)
+    except ValueError as e:
+        # The reader fell behind the bounded log; tell the client rather than
+        # leave it waiting for an [[END]] that will never be sent
+        print(f"Turn {log.turn_id}: {e}")
+        with suppress(Exception):
+            await websocket.send_text("[[RESUME_FAILED]]")
+            await websocket.send_text("[[END]]")
+    except (WebSocketDisconnect, RuntimeError):
+        pass  # Socket went away; the turn keeps running for a reconnect
+    except Exception as e:
+        print(f"Forwarding turn {log.turn_id} failed: {e}")
+        with suppress(Exception):
+            await websocket.send_text(f"[ERROR] {e}")
+            await websocket.send_text("[[END]]")
+
+async def delete_checkpoints(thread_id: str):
+    """Drop a thread's checkpoints and pending writes from the checkpoint DB."""
+    if hasattr(checkpointer, "adelete_thread"):
+        await checkpointer.adelete_thread(thread_id)
+        return
+    # Older AsyncSqliteSaver has no delete API; these are its two tables
+    async with checkpointer.lock:
+        await checkpointer.conn.execute("DELETE FROM checkpoints WHERE thread_id = ?", (thread_id,))
+        await checkpointer.conn.execute("DELETE FROM writes WHERE thread_id = ?", (thread_id,))
+        await checkpointer.conn.commit()
+
+async def cleanup_session_later(session_id: str):
+    """After the grace period with no socket open on any worker, stop any
+    leftover turn and remove the session's uploads, file state and checkpoints."""
+    await asyncio.sleep(turns.grace)
+    # A reconnect may have landed on another worker, so ask the shared store
+    if not await asyncio.to_thread(session_store.claim_expired, session_id, turns.grace):
+        return
+    if (log := turns.get(session_id)) and log.task:
+        await cancel_turn(log.task, init_graph(session_id, checkpointer),
+                          {"configurable": {"thread_id": session_id}})
+    try:
+        shutil.rmtree(session_upload_dir(session_id), ignore_errors=True)
+        await asyncio.to_thread(session_store.delete_session, session_id)
+        await delete_checkpoints(session_id)
+    except Exception as e:
+        print(f"Error cleaning up session {session_id}: {e}")
+
+async def cancel_turn(task, graph, config: RunnableConfig):
+    """
+    Stop a running turn at every layer. The task is cancelled first, so the
+    graph cannot start another model call, and that closes the provider HTTP
+    stream via the async chatbot node. Then the session's busy tool workers are
+    killed and its sandbox kernel interrupted (registered in chat.cancellation).
+    Finally any tool calls left unanswered in the checkpoint are closed.
+    """
+    if not task or task.done():
+        return
+    thread_id = config["configurable"]["thread_id"]
+    task.cancel()
+    freed = await asyncio.to_thread(cancellations.cancel, thread_id)
+    with suppress(asyncio.CancelledError):
+        await task
+    try:
+        if closed := await close_open_tool_calls(graph, config):
+            freed["tool_calls_closed"] = closed
+    except Exception as e:
+        print(f"Could not close open tool calls for {thread_id}: {e}")
+    if freed:
+        print(f"Cancelled turn for {thread_id}, freed: {dict(freed)}")
 
 @app.websocket("/ws/chat")
 async def chat_websocket(websocket: WebSocket):
     await websocket.accept()
 
-    thread_id = "websocket-client"
-    memory = memory_store.setdefault(thread_id, MemorySaver())
+    # A client may pass its session_id back to continue; otherwise start a new one
+    session_id = websocket.query_params.get("session_id", "")
+    if not valid_session_id(session_id):
+        session_id = str(uuid.uuid4())
+    await websocket.send_text(f"[[SESSION::{session_id}]]")
 
-    graph = init_graph(thread_id, memory)
-    config: RunnableConfig = {"configurable": {"thread_id": thread_id}}
+    thread_id = session_id
+    upload_dir = session_upload_dir(session_id)
+    os.makedirs(upload_dir, exist_ok=True)
 
-    default_mode = modes.get("default", "default")
-    if not isinstance(default_mode, str):
-        default_mode = "default"
-    graph.invoke({"messages": [HumanMessage(content=default_mode)]}, config)
+    graph = init_graph(thread_id, checkpointer)
+    config: RunnableConfig = {"configurable": {"thread_id": thread_id}}
+    await asyncio.to_thread(session_store.open_connection, session_id)
 
     message_queue = asyncio.Queue()
     receive_task = None
     consumer_task = None
+    forward_tasks = set()
+
+    def forward(log: TurnLog, offset: int = 0):
+        task = asyncio.create_task(forward_turn(log, websocket, offset))
+        forward_tasks.add(task)
+        task.add_done_callback(forward_tasks.discard)
+
+    # Reconnect mid-reply: replay the turn from the client's last offset and
+    # keep following it, instead of generating the reply again
+    resumed_task = None
+    resume_turn = websocket.query_params.get("resume_turn")
+    if resume_turn and (log := turns.get(session_id)) and log.turn_id == resume_turn:
+        offset = int(websocket.query_params.get("offset", "0") or 0)
+        await websocket.send_text(f"[[RESUME::{log.turn_id}]]")
+        forward(log, offset)
+        resumed_task = log.task
+    elif resume_turn:
+        await websocket.send_text("[[RESUME_FAILED]]")
 
     async def receive_messages():
         try:
@@ -83,15 +244,17 @@ async def chat_websocket(websocket: WebSocket):
             print(f"Error in receive_messages: {e}")
 
     async def consumer():
-        current_stream_task = None
+        current_stream_task = resumed_task
+        next_input_task = None
         try:
             while True:
                 user_input = await message_queue.get()
 
                 if user_input.startswith("/mode "):
                     mode_key = user_input.removeprefix("/mode ").strip()
-                    if mode_prompt := modes.get(mode_key):
-                        graph.invoke({"messages": [HumanMessage(content=mode_prompt)]}, config)
+                    if mode_key in modes:
+                        # The persona is a state slot read at call time, so no LLM round trip
+                        await graph.aupdate_state(config, {"mode": mode_key}, as_node="chatbot")
                         await websocket.send_text(f"[Mode changed to: {mode_key}]")
                     else:
                         await websocket.send_text(f"[Error] Unknown mode: {mode_key}")
@@ -103,10 +266,13 @@ async def chat_websocket(websocket: WebSocket):
                     unreadable = []
                     loaded_texts = []
 
-                    for filename, original_name in file_map_backend.items():
-                        if filename in loaded_files_set:
+                    # The session store is blocking SQLite, so it stays off the event loop
+                    loaded_keys = await asyncio.to_thread(session_store.loaded_files, session_id)
+                    files = await asyncio.to_thread(session_store.get_files, session_id)
+                    for filename, original_name in files.items():
+                        if filename in loaded_keys:
                             continue
-                        file_path = os.path.join(UPLOAD_DIR, filename)
+                        file_path = os.path.join(upload_dir, filename)
                         try:
                             with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
                                 text = f.read().strip()
@@ -115,17 +281,17 @@ async def chat_websocket(websocket: WebSocket):
                                     readable.append(original_name)
                                 else:
                                     unreadable.append(original_name)
-                                loaded_files_set.add(filename)
+                                await asyncio.to_thread(session_store.mark_loaded, session_id, filename)
                         except Exception as e:
                             print(f"Error reading {file_path}: {e}")
                             unreadable.append(original_name)
 
                     if loaded_texts:
-                        context_block = ""
-                        for filename, content in zip(readable, loaded_texts):
-                            context_block += f"[FILE: {filename}]\n{content}\n\n"
-
-                        await graph.ainvoke({"messages": [SystemMessage(content=context_block)]}, config)
+                        # Files go into their own state slot, which the graph places
+                        # ahead of the conversation as a stable, cacheable prefix
+                        await graph.aupdate_state(
+                            config, {"context_files": dict(zip(readable, loaded_texts))}, as_node="chatbot"
+                        )
 
                     summary_prompt = """
                         Confirm that you have successfully loaded the files in context.
@@ -143,7 +309,9 @@ async def chat_websocket(websocket: WebSocket):
                         summary_prompt = "The files I uploaded seem to be binary or unreadable. Disregard them."
 
                     if summary_prompt:
-                        response = await graph.ainvoke({"messages": [HumanMessage(content=summary_prompt)]}, config)
+                        # Confirmation only, so it yields to other sessions' interactive turns
+                        background = {"configurable": {**config["configurable"], "priority": "background"}}
+                        response = await graph.ainvoke({"messages": [HumanMessage(content=summary_prompt)]}, background)
                         reply_text = response["messages"][-1].content
                         await websocket.send_text(f"[[LOADED::{','.join(readable)}]]")
                         await websocket.send_text(reply_text + "\n")
@@ -156,16 +324,18 @@ async def chat_websocket(websocket: WebSocket):
                     continue
 
                 if user_input == "__STOP__":
-                    if current_stream_task and not current_stream_task.done():
-                        current_stream_task.cancel()
-                        with suppress(asyncio.CancelledError):
-                            await current_stream_task
+                    await cancel_turn(current_stream_task, graph, config)
                     await websocket.send_text("[[END]]")
                     continue
 
-                current_stream_task = asyncio.create_task(
-                    stream_response(graph, websocket, user_input, config)
+                # A turn resumed from an earlier connection may still be running
+                await cancel_turn(current_stream_task, graph, config)
+                log = turns.start(thread_id)
+                await websocket.send_text(f"[[TURN::{log.turn_id}]]")
+                current_stream_task = log.task = asyncio.create_task(
+                    stream_response(graph, log, user_input, config)
                 )
+                forward(log)
 
                 next_input_task = asyncio.create_task(message_queue.get())
                 done, _ = await asyncio.wait(
@@ -175,9 +345,7 @@ async def chat_websocket(websocket: WebSocket):
 
                 if next_input_task in done:
                     new_msg = next_input_task.result()
-                    current_stream_task.cancel()
-                    with suppress(asyncio.CancelledError):
-                        await current_stream_task
+                    await cancel_turn(current_stream_task, graph, config)
                     await websocket.send_text("[[END]]")
                     await message_queue.put(new_msg)
                 else:
@@ -185,17 +353,17 @@ async def chat_websocket(websocket: WebSocket):
                     current_stream_task = None
 
         except asyncio.CancelledError:
+            # Disconnect: the running turn is left going so the client can resume it
+            if next_input_task is not None:
+                next_input_task.cancel()
             print("Consumer task cancelled — exiting cleanly.")
-        finally:
-            if current_stream_task and not current_stream_task.done():
-                current_stream_task.cancel()
-                with suppress(asyncio.CancelledError):
-                    await current_stream_task
 
     try:
         receive_task = asyncio.create_task(receive_messages())
         consumer_task = asyncio.create_task(consumer())
-        await asyncio.gather(receive_task, consumer_task)
+        # receive_messages returns on disconnect while the consumer is still
+        # waiting on the queue, so whichever ends first ends the handler
+        await asyncio.wait([receive_task, consumer_task], return_when=asyncio.FIRST_COMPLETED)
     except asyncio.CancelledError:
         print("WebSocket handler cancelled.")
     finally:
@@ -203,46 +371,56 @@ async def chat_websocket(websocket: WebSocket):
             await websocket.close()
         except Exception:
             pass
-        for task in (receive_task, consumer_task):
-            if task and not task.done():
+        tasks = [t for t in (receive_task, consumer_task, *forward_tasks) if t]
+        for task in tasks:
+            if not task.done():
                 task.cancel()
-        await asyncio.gather(*(t for t in (receive_task, consumer_task) if t), return_exceptions=True)
-        try:
-            if os.path.exists(UPLOAD_DIR):
-                shutil.rmtree(UPLOAD_DIR)
-                os.makedirs(UPLOAD_DIR, exist_ok=True)
-        except Exception as e:
-            print(f"Error cleaning up user_files: {e}")
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await asyncio.to_thread(session_store.close_connection, session_id)
+        asyncio.create_task(cleanup_session_later(session_id))
         print("Server cleanup done.")
 
+@app.get("/metrics")
+async def metrics():
+    return {
+        "scheduler": scheduler.stats,
+        "cancellation": cancellations.snapshot(),
+        "prompt_cache": cache_stats.snapshot(),
+    }
+
 @app.post("/upload")
-async def upload_files(files: List[UploadFile] = File(...)):
+async def upload_files(files: List[UploadFile] = File(...), session_id: str = Form(...)):
+    if not valid_session_id(session_id):
+        return JSONResponse(status_code=400, content={"error": "Invalid session_id"})
+    upload_dir = session_upload_dir(session_id)
+    os.makedirs(upload_dir, exist_ok=True)
+
     saved_files = []
     key_map = {}
     for file in files:
-        key = f"{int(time.time() * 1000)}_{file.filename}"
-        file_path = os.path.join(UPLOAD_DIR, key)
+        key = f"{int(time.time() * 1000)}_{os.path.basename(file.filename)}"
+        file_path = os.path.join(upload_dir, key)
         with open(file_path, "wb") as f:
             content = await file.read()
             f.write(content)
-        file_map_backend[key] = file.filename
+        await asyncio.to_thread(session_store.add_file, session_id, key, file.filename)
         key_map[key] = file.filename
         saved_files.append(file.filename)
     return {"status": "success", "uploaded": saved_files, "file_map": key_map}
 
 @app.post("/delete-file")
-async def delete_file(file_key: str = Form(...)):
-    filename = file_map_backend.get(file_key)
-    if not filename:
+async def delete_file(file_key: str = Form(...), session_id: str = Form(...)):
+    if (not valid_session_id(session_id)
+            or file_key not in await asyncio.to_thread(session_store.get_files, session_id)):
         return JSONResponse(status_code=404, content={"error": "File not found"})
-    file_path = os.path.join(UPLOAD_DIR, file_key)
+    file_path = os.path.join(session_upload_dir(session_id), os.path.basename(file_key))
     try:
         os.remove(file_path)
-        del file_map_backend[file_key]
+        await asyncio.to_thread(session_store.remove_file, session_id, file_key)
         return {"status": "deleted"}
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": str(e)})
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=4580, timeout_keep_alive=5)
+    uvicorn.run("server:app", host="0.0.0.0", port=4580, timeout_keep_alive=5, workers=SERVER_WORKERS)
@@ -0,0 +1,139 @@
+# session_store.py
+
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+
+
+class SessionStore(ABC):
+    """
+    Per-session server state that must be visible to every worker process:
+    uploaded files (key -> original name) and which of them are loaded into
+    the chat context. A networked store (Redis, Postgres, ...) only needs to
+    implement these methods.
+    """
+
+    @abstractmethod
+    def add_file(self, session_id: str, key: str, original_name: str): ...
+
+    @abstractmethod
+    def get_files(self, session_id: str) -> dict[str, str]: ...
+
+    @abstractmethod
+    def remove_file(self, session_id: str, key: str) -> str | None: ...
+
+    @abstractmethod
+    def mark_loaded(self, session_id: str, key: str): ...
+
+    @abstractmethod
+    def loaded_files(self, session_id: str) -> set[str]: ...
+
+    @abstractmethod
+    def delete_session(self, session_id: str): ...
+
+    @abstractmethod
+    def open_connection(self, session_id: str): ...
+
+    @abstractmethod
+    def close_connection(self, session_id: str): ...
+
+    @abstractmethod
+    def claim_expired(self, session_id: str, idle_for: float) -> bool:
+        """True (once) if no worker has the session open and it was last seen
+        at least `idle_for` seconds ago; the caller then owns its cleanup."""
+
+
+class SqliteSessionStore(SessionStore):
+    """Local SessionStore. WAL mode lets several uvicorn workers share the file."""
+
+    def __init__(self, path: str):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS files (
+                session_id TEXT NOT NULL,
+                file_key TEXT NOT NULL,
+                original_name TEXT NOT NULL,
+                loaded INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (session_id, file_key)
+            )"""
+        )
+        # Open sockets per session across all workers, so a worker only cleans
+        # up a session that no other worker is serving
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS connections (
+                session_id TEXT PRIMARY KEY,
+                open INTEGER NOT NULL,
+                last_seen REAL NOT NULL
+            )"""
+        )
+        self._conn.commit()
+
+    def _execute(self, sql: str, params: tuple = ()) -> list:
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+            self._conn.commit()
+            return rows
+
+    def add_file(self, session_id: str, key: str, original_name: str):
+        self._execute(
+            "INSERT OR REPLACE INTO files VALUES (?, ?, ?, 0, ?)",
+            (session_id, key, original_name, time.time()),
+        )
+
+    def get_files(self, session_id: str) -> dict[str, str]:
+        rows = self._execute(
+            "SELECT file_key, original_name FROM files WHERE session_id = ? ORDER BY created_at",
+            (session_id,),
+        )
+        return dict(rows)
+
+    def remove_file(self, session_id: str, key: str) -> str | None:
+        rows = self._execute(
+            "DELETE FROM files WHERE session_id = ? AND file_key = ? RETURNING original_name",
+            (session_id, key),
+        )
+        return rows[0][0] if rows else None
+
+    def mark_loaded(self, session_id: str, key: str):
+        self._execute(
+            "UPDATE files SET loaded = 1 WHERE session_id = ? AND file_key = ?",
+            (session_id, key),
+        )
+
+    def loaded_files(self, session_id: str) -> set[str]:
+        rows = self._execute(
+            "SELECT file_key FROM files WHERE session_id = ? AND loaded = 1",
+            (session_id,),
+        )
+        return {key for (key,) in rows}
+
+    def delete_session(self, session_id: str):
+        self._execute("DELETE FROM files WHERE session_id = ?", (session_id,))
+
+    def open_connection(self, session_id: str):
+        self._execute(
+            """INSERT INTO connections VALUES (?, 1, ?)
+               ON CONFLICT(session_id) DO UPDATE SET open = open + 1, last_seen = excluded.last_seen""",
+            (session_id, time.time()),
+        )
+
+    def close_connection(self, session_id: str):
+        self._execute(
+            "UPDATE connections SET open = MAX(open - 1, 0), last_seen = ? WHERE session_id = ?",
+            (time.time(), session_id),
+        )
+
+    def claim_expired(self, session_id: str, idle_for: float) -> bool:
+        # Check and delete in one statement, so only one worker wins the claim
+        rows = self._execute(
+            "DELETE FROM connections WHERE session_id = ? AND open = 0 AND last_seen <= ? RETURNING session_id",
+            (session_id, time.time() - idle_for),
+        )
+        return bool(rows)
@@ -0,0 +1,90 @@
+# turn_log.py
+
+import asyncio
+import time
+import uuid
+
+
+class TurnLog:
+    """
+    Everything one turn sends to the client, in order, so a client that
+    reconnects mid-reply can resume from the last offset it received instead of
+    regenerating. Bounded to `max_chunks`; older entries are dropped and
+    `base` records how many were dropped.
+    """
+
+    def __init__(self, session_id: str, max_chunks: int = 5000):
+        self.turn_id = uuid.uuid4().hex[:12]
+        self.session_id = session_id
+        self.max_chunks = max_chunks
+        self.chunks: list[str] = []
+        self.base = 0
+        self.done = False
+        self.finished_at: float | None = None
+        self.task: asyncio.Task | None = None
+        self._changed = asyncio.Event()
+
+    @property
+    def end(self) -> int:
+        return self.base + len(self.chunks)
+
+    def append(self, chunk: str):
+        self.chunks.append(chunk)
+        if len(self.chunks) > self.max_chunks:
+            drop = len(self.chunks) - self.max_chunks
+            del self.chunks[:drop]
+            self.base += drop
+        self._changed.set()
+
+    def finish(self):
+        self.done = True
+        self.finished_at = time.time()
+        self._changed.set()
+
+    async def follow(self, offset: int = 0):
+        """
+        Yield chunks from `offset` on, waiting for new ones until the turn is
+        done. Raises ValueError if the reader falls so far behind that the
+        chunks it needs were dropped, whether on entry or while following.
+        """
+        while True:
+            while offset < self.end:
+                # Checked on every step: the log can be trimmed while we are suspended
+                if offset < self.base:
+                    raise ValueError(f"offset {offset} is no longer in the log (starts at {self.base})")
+                yield self.chunks[offset - self.base]
+                offset += 1
+            if offset < self.base:
+                raise ValueError(f"offset {offset} is no longer in the log (starts at {self.base})")
+            if self.done:
+                return
+            self._changed.clear()
+            await self._changed.wait()
+
+
+class TurnRegistry:
+    """
+    Latest turn per session, kept for `grace` seconds after it finishes.
+    In-process only: with several workers, reconnects must be routed back to
+    the same worker (sticky sessions on session_id).
+    """
+
+    def __init__(self, grace: float = 120.0):
+        self.grace = grace
+        self._turns: dict[str, TurnLog] = {}
+
+    def start(self, session_id: str) -> TurnLog:
+        self.expire()
+        log = TurnLog(session_id)
+        self._turns[session_id] = log
+        return log
+
+    def get(self, session_id: str) -> TurnLog | None:
+        self.expire()
+        return self._turns.get(session_id)
+
+    def expire(self):
+        now = time.time()
+        for session_id, log in list(self._turns.items()):
+            if log.done and now - log.finished_at > self.grace:
+                del self._turns[session_id]